@@ -2,138 +2,437 @@ import os
 import csv
 import argparse
 import sys
+import pickle
+import functools
+import re
+import json
+import heapq
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pac
+except ImportError:
+    pa = pac = None
 
 # 设置基础目录
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 DATA_DIR = os.path.join(BASE_DIR, "data")
+# 倒排索引缓存 (按 CSV 的 size/mtime 指纹失效)
+INDEX_PATH = os.path.join(DATA_DIR, ".index.pkl")
+INDEX_VERSION = 3
+# --list 使用的行数缓存: {filename: {size, mtime, rows}}
+META_PATH = os.path.join(DATA_DIR, ".meta.json")
 
-# --- 扩展: 常见同义词映射库 ---
-# 用于反向推导 Enum Key
-EFFECT_SYNONYMS = {
-    "typewriter": ["打字机", "字幕", "typing", "复古打字机"],
-    "fade": ["渐隐", "渐显", "黑场", "白场", "fade_in", "fade_out"],
-    "glitch": ["故障", "干扰", "燥波", "雪花"],
-    "zoom": ["拉近", "拉远", "缩放", "变焦"],
-    "shake": ["振动", "摇晃", "抖动"],
-    "blur": ["模糊", "虚化"],
-    "glow": ["发光", "辉光", "霓虹"],
-    "retro": ["复古", "胶片", "怀旧", "DV"],
-    "dissolve": ["叠化", "溶解", "混合"],
-}
-
-SYNONYMS = {
-    # 常用英文 -> 中文
-    "dissolve": ["叠化", "溶解", "混合"],
-    "fade": ["渐隐", "渐显", "黑场", "白场"],
-    "glitch": ["故障", "干扰", "燥波", "雪花"],
-    "zoom": ["拉近", "拉远", "缩放", "变焦"],
-    "shake": ["振动", "摇晃", "抖动"],
-    "blur": ["模糊", "虚化"],
-    "glow": ["发光", "辉光", "霓虹"],
-    "retro": ["复古", "胶片", "怀旧", "DV"],
-    "film": ["胶片", "电影", "颗粒"],
-    "typewriter": ["打字机", "字幕"],
-    "particle": ["粒子", "碎片"],
-    "fire": ["火", "燃烧", "烈焰"],
-    "rain": ["雨", "水滴"],
-    "cyber": ["赛博", "科技", "数码"],
-    "scan": ["扫描", "全息"],
+# --- 扩展: 常见同义词映射库 (唯一数据源) ---
+# 同义词表及其派生结构都按需构建: --list 等不带查询的调用不付出这部分开销
+@functools.cache
+def _synonyms():
+    return {
+        # 常用英文 -> 中文
+        "dissolve": ["叠化", "溶解", "混合"],
+        "fade": ["渐隐", "渐显", "黑场", "白场", "fade_in", "fade_out"],
+        "glitch": ["故障", "干扰", "燥波", "雪花"],
+        "zoom": ["拉近", "拉远", "缩放", "变焦"],
+        "shake": ["振动", "摇晃", "抖动"],
+        "blur": ["模糊", "虚化"],
+        "glow": ["发光", "辉光", "霓虹"],
+        "retro": ["复古", "胶片", "怀旧", "DV"],
+        "film": ["胶片", "电影", "颗粒"],
+        "typewriter": ["打字机", "字幕", "typing", "复古打字机"],
+        "particle": ["粒子", "碎片"],
+        "fire": ["火", "燃烧", "烈焰"],
+        "rain": ["雨", "水滴"],
+        "cyber": ["赛博", "科技", "数码"],
+        "scan": ["扫描", "全息"],
     
-    # 场景化描述
-    "tech": ["科技", "全息", "扫描", "数据"],
-    "memory": ["回忆", "黑白", "泛黄", "柔光"],
-    "horror": ["恐怖", "惊悚", "暗黑", "血"],
-    "happy": ["欢乐", "跳动", "弹力"],
-}
+        # 场景化描述
+        "tech": ["科技", "全息", "扫描", "数据"],
+        "memory": ["回忆", "黑白", "泛黄", "柔光"],
+        "horror": ["恐怖", "惊悚", "暗黑", "血"],
+        "happy": ["欢乐", "跳动", "弹力"],
+    }
+
+# 可反向推导 Enum Key 的子集, 顺序即匹配优先级
+ENUM_KEYS = ("typewriter", "fade", "glitch", "zoom", "shake", "blur", "glow", "retro", "dissolve")
+
+@functools.cache
+def _effect_synonyms():
+    synonyms = _synonyms()
+    return {k: synonyms[k] for k in ENUM_KEYS}
+
+@functools.cache
+def _key_substrings():
+    """key 的所有子串 -> 包含它的 key 列表, 让"词是某个 key 的一部分"的模糊扩展变成一次字典查找"""
+    index = {}
+    for key in _synonyms():
+        for sub in {key[i:j] for i in range(len(key)) for j in range(i + 1, len(key) + 1)}:
+            index.setdefault(sub, []).append(key)
+    return index
 
+@functools.lru_cache(maxsize=1024)
 def expand_query_with_synonyms(query):
-    """扩展查询词"""
+    """扩展查询词 (返回 frozenset, 便于缓存复用)"""
+    synonyms = _synonyms()
     terms = query.lower().split()
     expanded_terms = set(terms)
     for term in terms:
-        if term in SYNONYMS:
-            expanded_terms.update(SYNONYMS[term])
+        if term in synonyms:
+            expanded_terms.update(synonyms[term])
         else:
-            for key, values in SYNONYMS.items():
-                if term in key:
-                    expanded_terms.update(values)
-    return list(expanded_terms)
+            for key in _key_substrings().get(term, ()):
+                expanded_terms.update(synonyms[key])
+    return frozenset(expanded_terms)
+
+@functools.cache
+def _enum_matcher():
+    """返回 (同义词正则, 同义词 -> 最优 key 序号)"""
+    # 同义词 -> Enum Key 反查表 (同一个词出现在多个 key 下时, 以字典中靠前的为准)
+    syn_to_key = {}
+    for key, syns in _effect_synonyms().items():
+        for syn in [key] + syns:
+            syn_to_key.setdefault(syn, key)
+
+    # 每个同义词命中时, 其子串也必然命中; 预先算出其中优先级最高的 key 的序号
+    best_rank = {
+        syn: min(ENUM_KEYS.index(syn_to_key[sub]) for sub in syn_to_key if sub in syn)
+        for syn in syn_to_key
+    }
+
+    # 所有同义词合成一个正则 (lookahead 允许重叠, 长词优先), 一次 C 层扫描代替双重循环
+    pattern = re.compile(
+        "(?=(" + "|".join(map(re.escape, sorted(syn_to_key, key=len, reverse=True))) + "))"
+    )
+    return pattern, best_rank
 
+@functools.lru_cache(maxsize=4096)
 def get_enum_key_from_ident(ident):
     """尝试从中文标识符反推英文 Enum Key"""
-    ident_lower = ident.lower()
-    for key, synonyms in EFFECT_SYNONYMS.items():
-        if key in ident_lower: return key
-        for syn in synonyms:
-            if syn in ident_lower:
-                return key
-    return ""
+    pattern, best_rank = _enum_matcher()
+    rank = min((best_rank[m.group(1)] for m in pattern.finditer(ident.lower())), default=None)
+    return "" if rank is None else ENUM_KEYS[rank]
 
-def search_assets(query, category=None, limit=20):
-    """搜索资产"""
-    results = []
-    search_terms = expand_query_with_synonyms(query)
-    
-    files_to_search = []
-    if category:
-        if not category.endswith('.csv'): category += '.csv'
-        files_to_search = [category]
-    else:
-        if os.path.exists(DATA_DIR):
-            files_to_search = [f for f in os.listdir(DATA_DIR) if f.endswith('.csv')]
+def _list_csv_files():
+    return [f for f in os.listdir(DATA_DIR) if f.endswith('.csv')]
+
+def _fingerprint(files):
+    fp = []
+    for filename in files:
+        st = os.stat(os.path.join(DATA_DIR, filename))
+        fp.append((filename, st.st_size, st.st_mtime_ns))
+    return tuple(fp)
+
+def _grams(text):
+    """单字 + 双字 gram。中文标识符没有空格可切词, 用 n-gram 才能保证子串匹配不漏结果"""
+    grams = set(text)
+    grams.update(text[i:i + 2] for i in range(len(text) - 1))
+    return grams
+
+def _columns_from_rows(header, reader):
+    """标准库 csv 行 -> {列名: [值...]}, 行短于表头时补 ''"""
+    records = [r for r in reader if r]
+    columns = {}
+    for i, name in enumerate(header):
+        columns[name] = [r[i] if i < len(r) else '' for r in records]
+    return columns
+
+def _read_csv_columns(filepath):
+    """按列读取 CSV, 返回 (表头, {列名: [值...]})。装了 pyarrow 时用其 C++ 解析器, 否则退回标准库 csv"""
+    with open(filepath, 'r', encoding='utf-8', newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader, [])
+        # 空文件 / 只有表头时没什么可加速的
+        if pac is None or not header:
+            return header, _columns_from_rows(header, reader)
+
+    try:
+        table = pac.read_csv(
+            filepath,
+            # 与 csv 模块一致: 引号内允许换行
+            parse_options=pac.ParseOptions(newlines_in_values=True),
+            convert_options=pac.ConvertOptions(column_types={name: pa.string() for name in header}),
+        )
+        return header, {name: table.column(name).to_pylist() for name in header}
+    except pa.ArrowInvalid:
+        # 行长不齐等 pyarrow 拒绝而 csv 模块能读的文件: 退回标准库, 不让一个文件拖垮整个索引
+        with open(filepath, 'r', encoding='utf-8', newline='') as f:
+            reader = csv.reader(f)
+            next(reader, None)
+            return header, _columns_from_rows(header, reader)
+
+def build_index(files=None):
+    """遍历 DATA_DIR 下的 CSV, 构建 gram -> row_id 倒排表"""
+    if files is None:
+        files = _list_csv_files()
+    source_file = []  # 每行所属文件 (列式存储, 不再为每行分配 dict)
+    hay = []  # 预先拼好并转小写的检索文本, 与 source_file 一一对应
+    file_ranges = {}
+    headers = {}
+    tables = {}
+    postings = {}
+    # 各 CSV 相互独立, 并行解析 (pyarrow 解析时会释放 GIL); map 保持文件顺序, 合并结果可复现
+    with ThreadPoolExecutor(max_workers=min(len(files), os.cpu_count() or 1) or 1) as ex:
+        parsed = list(ex.map(lambda fn: _read_csv_columns(os.path.join(DATA_DIR, fn)), files))
+
+    for filename, (header, columns) in zip(files, parsed):
+        start = len(hay)
+        n_rows = len(columns[header[0]]) if header else 0
+        empty = [''] * n_rows
+        texts = zip(columns.get('identifier', empty),
+                    columns.get('description', empty),
+                    columns.get('category', empty))
+        for ident, desc, cat in texts:
+            row_id = len(hay)
+            target_text = ((ident or '') + " " + (desc or '') + " " + (cat or '')).lower()
+            hay.append(target_text)
+            for gram in _grams(target_text):
+                postings.setdefault(gram, []).append(row_id)
+        source_file.extend([sys.intern(filename)] * n_rows)
+        file_ranges[filename] = (start, len(hay))
+        headers[filename] = header
+        tables[filename] = columns
+    return {
+        "version": INDEX_VERSION,
+        "fingerprint": _fingerprint(files),
+        "source_file": source_file,
+        "hay": hay,
+        "files": file_ranges,
+        "headers": headers,
+        "tables": tables,
+        "postings": postings,
+    }
+
+def _materialize(index, row_id, score):
+    """只为最终返回的行还原出 dict (与原 CSV 行的字段一致)"""
+    filename = index["source_file"][row_id]
+    i = row_id - index["files"][filename][0]
+    columns = index["tables"][filename]
+    row = {name: columns[name][i] for name in index["headers"][filename]}
+    row['source_file'] = filename
+    row['score'] = score
+    return row
+
+def _intern_categoricals(index):
+    """低基数列 (分类/来源文件) 全部 sys.intern, 相同取值只保留一份且比较退化为指针比较。
+    pickle 还原出的字符串不会自动 intern, 所以加载缓存后也要做一遍。"""
+    for columns in index["tables"].values():
+        if 'category' in columns:
+            columns['category'] = [sys.intern(c) for c in columns['category']]
+    index["source_file"] = [sys.intern(f) for f in index["source_file"]]
+    return index
+
+def load_index():
+    """优先读取磁盘缓存的索引, CSV 有变动时重建并回写"""
+    files = _list_csv_files()
+    fingerprint = _fingerprint(files)
+    try:
+        with open(INDEX_PATH, 'rb') as f:
+            index = pickle.load(f)
+        if index.get("version") == INDEX_VERSION and index.get("fingerprint") == fingerprint:
+            return _intern_categoricals(index)
+    except Exception:
+        pass
+
+    index = _intern_categoricals(build_index(files))
+    try:
+        tmp_path = INDEX_PATH + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(index, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, INDEX_PATH)
+    except OSError:
+        pass  # 数据目录只读时仅使用内存索引
+    return index
+
+def _candidates(postings, term):
+    """用 gram 倒排表求出可能包含 term 的行 (候选集, 仍需逐行校验)"""
+    grams = {term[i:i + 2] for i in range(len(term) - 1)} or {term}
+    lists = sorted((postings.get(g, ()) for g in grams), key=len)
+    result = set(lists[0])
+    for lst in lists[1:]:
+        if not result: break
+        result.intersection_update(lst)
+    return result
+
+@functools.lru_cache(maxsize=256)
+def _compile_terms(terms):
+    """把一组扩展词编译成一个可重叠匹配的正则, 一次扫描找出文本命中了哪些词。
+
+    lookahead 在每个位置只报告最长的那个词, 但被它包含的短词必然也出现在文本里,
+    所以用 covers 把命中词展开成它包含的全部扩展词 (按词编号压成 int 位掩码),
+    命中词数 = 掩码的 bit_count(), 结果与逐词 `in` 判断一致。
+    """
+    ordered = sorted(terms, key=len, reverse=True)
+    pattern = re.compile("(?=(" + "|".join(map(re.escape, ordered)) + "))")
+    bit = {t: 1 << i for i, t in enumerate(ordered)}
+    covers = {t: sum(bit[sub] for sub in ordered if sub in t) for t in ordered}
+    return pattern, covers
+
+class AssetSearcher:
+    """常驻检索器: 索引只加载一次, 之后的查询直接复用内存中的数据。
+
+    CLI 单次调用与 --serve 常驻模式共用同一套逻辑; 每次查询前只 stat 一遍 CSV,
+    数据有变动时才重新加载索引。
+    """
+
+    def __init__(self):
+        self.index = load_index()
+
+    def _ensure_fresh(self):
+        if _fingerprint(_list_csv_files()) != self.index["fingerprint"]:
+            self.index = load_index()
+
+    def search(self, query, category=None, limit=20):
+        """搜索资产"""
+        search_terms = expand_query_with_synonyms(query)
+
+        self._ensure_fresh()
+        index = self.index
+        hay = index["hay"]
+        if category:
+            if not category.endswith('.csv'): category += '.csv'
+            if category not in index["files"]: return []
+            lo, hi = index["files"][category]
         else:
-            print(f"❌ Error: Data directory not found at {DATA_DIR}")
-            return []
-
-    for filename in files_to_search:
-        filepath = os.path.join(DATA_DIR, filename)
-        if not os.path.exists(filepath): continue
-            
-        with open(filepath, 'r', encoding='utf-8') as f:
-            reader = csv.DictReader(f)
-            for row in reader:
-                target_text = (row.get('identifier', '') + " " + 
-                               row.get('description', '') + " " + 
-                               row.get('category', '')).lower()
-                
+            lo, hi = 0, len(hay)
+
+        if not search_terms:
+            # 空查询 / 纯空白: 与逐行扫描一致, 包含 query 的行 (通常是全部) 各得 100 分, 按文件顺序取前 limit 个
+            q_lower = query.lower()
+            hits = [row_id for row_id in range(lo, hi) if q_lower in hay[row_id]][:limit]
+            return [_materialize(index, row_id, 100) for row_id in hits]
+
+        # 含完整 query 的行必然包含 query 的每个词, 所以候选集只需按扩展词求并集
+        candidates = set()
+        for term in search_terms:
+            candidates |= _candidates(index["postings"], term)
+
+        term_re, covers = _compile_terms(search_terms)
+        # 循环内只用局部变量: query 只转一次小写, 正则方法提前绑定
+        q_lower = query.lower()
+        finditer = term_re.finditer
+
+        def _scored():
+            for row_id in sorted(c for c in candidates if lo <= c < hi):
+                target_text = hay[row_id]
+
                 score = 0
-                if query.lower() in target_text: score += 100
-                for term in search_terms:
-                    if term in target_text: score += 10
-                
+                if q_lower in target_text: score += 100
+                mask = 0
+                for m in finditer(target_text):
+                    mask |= covers[m.group(1)]
+                score += 10 * mask.bit_count()
+
                 if score > 0:
-                    row['score'] = score
-                    row['source_file'] = filename
-                    results.append(row)
+                    yield score, row_id
 
-    results.sort(key=lambda x: x['score'], reverse=True)
-    return results[:limit]
+        # nlargest 内部只维护 limit 大小的堆, 结果等价于稳定排序后取前 limit 个
+        top = heapq.nlargest(limit, _scored(), key=lambda x: x[0])
+        return [_materialize(index, row_id, score) for score, row_id in top]
+
+_searcher = None
+
+def search_assets(query, category=None, limit=20):
+    """搜索资产"""
+    global _searcher
+    if not os.path.exists(DATA_DIR):
+        print(f"❌ Error: Data directory not found at {DATA_DIR}")
+        return []
+    if _searcher is None:
+        _searcher = AssetSearcher()
+    return _searcher.search(query, category, limit)
+
+def serve(stdin=None, stdout=None):
+    """常驻模式: 每行读入一个请求, 每行输出一个 JSON 结果。
+
+    请求可以是 JSON 对象 {"query": ..., "category": ..., "limit": ...}, 也可以直接是关键词文本。
+    """
+    stdin = stdin or sys.stdin
+    stdout = stdout or sys.stdout
+    searcher = AssetSearcher()
+    while line := stdin.readline():
+        line = line.strip()
+        if not line: continue
+        try:
+            req = json.loads(line) if line.startswith('{') else {"query": line}
+            results = searcher.search(req["query"], req.get("category"), int(req.get("limit", 20)))
+            reply = {"results": results, "text": format_results(results)}
+        except Exception as e:
+            reply = {"error": str(e)}
+        stdout.write(json.dumps(reply, ensure_ascii=False) + "\n")
+        stdout.flush()
+
+def _load_meta():
+    try:
+        with open(META_PATH, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except Exception:
+        return {}
+
+def _save_meta(meta):
+    try:
+        tmp_path = META_PATH + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, META_PATH)
+    except OSError:
+        pass
+
+def _count_rows(path):
+    """数据行数 (不含表头)。无缓冲地按 1 MiB 原始字节块统计换行符, 不逐行解码;
+    末行无换行时补 1, 与逐行计数一致"""
+    lines = 0
+    last = b''
+    with open(path, 'rb', buffering=0) as f:
+        for buf in iter(lambda: f.read(1 << 20), b''):
+            lines += buf.count(b'\n')
+            last = buf[-1:]
+    if last and last != b'\n':
+        lines += 1
+    return lines - 1
+
+def list_categories():
+    """返回 [(filename, 数据行数)], 只对 size/mtime 变化过的 CSV 重新计数"""
+    meta = _load_meta()
+    fresh = {}
+    listing = []
+    for filename in sorted(_list_csv_files()):
+        st = os.stat(os.path.join(DATA_DIR, filename))
+        entry = meta.get(filename)
+        if not entry or entry.get("size") != st.st_size or entry.get("mtime") != st.st_mtime_ns:
+            entry = {
+                "size": st.st_size,
+                "mtime": st.st_mtime_ns,
+                "rows": _count_rows(os.path.join(DATA_DIR, filename)),
+            }
+        fresh[filename] = entry
+        listing.append((filename, entry["rows"]))
+    if fresh != meta:
+        _save_meta(fresh)
+    return listing
+
+# 结果表格的行模板, 只解析一次格式串
+_ROW_FMT = "{:<25} | {:<15} | {:<20} | {}".format
 
 def format_results(results):
     if not results:
         return "❌ 未找到匹配项。尝试使用更简单的中文关键词。"
     
-    output = []
     # 明确告诉 Agent: 这些中文名就是可以直接用的 ID
-    header = f"{'Identifier':<25} | {'Category':<15} | {'API Key (Use This)':<20} | {'Source'}"
-    output.append(header)
-    output.append("-" * len(header))
+    header = _ROW_FMT('Identifier', 'Category', 'API Key (Use This)', 'Source')
+    output = [header, "-" * len(header)]
     
     for r in results:
         ident = r.get('identifier', 'N/A')
-        display_ident = ident
-        if len(display_ident) > 23: display_ident = display_ident[:20] + "..."
-        
-        cat = r.get('category', 'N/A')[:15]
-        src = r.get('source_file', '').replace('.csv', '')
-        
-        enum_key = get_enum_key_from_ident(ident)
-        if not enum_key:
-            enum_key = ident  # Fallback to Chinese Key
+        display_ident = (ident[:20] + "...") if len(ident) > 23 else ident
         
+        # Fallback to Chinese Key
+        enum_key = get_enum_key_from_ident(ident) or ident
         if len(enum_key) > 18: enum_key = enum_key[:15] + "..."
 
-        output.append(f"{display_ident:<25} | {cat:<15} | {enum_key:<20} | {src}")
+        output.append(_ROW_FMT(display_ident,
+                               r.get('category', 'N/A')[:15],
+                               enum_key,
+                               r.get('source_file', '').replace('.csv', '')))
         
     return "\n".join(output)
 
@@ -143,16 +442,22 @@ if __name__ == "__main__":
     parser.add_argument("-c", "--category", help="限定分类")
     parser.add_argument("-l", "--limit", type=int, default=20, help="数量限制")
     parser.add_argument("--list", action="store_true", help="列出分类")
+    parser.add_argument("--serve", action="store_true", help="常驻模式: 从 stdin 逐行读取查询, 输出 JSON 行")
     
     args = parser.parse_args()
     
     if args.list:
         print("=== 剪映资产数据库概览 ===")
         if os.path.exists(DATA_DIR):
-            for filename in sorted(os.listdir(DATA_DIR)):
-                if filename.endswith('.csv'):
-                    with open(os.path.join(DATA_DIR, filename), 'r', encoding='utf-8') as f:
-                        print(f"{filename:<30} | {sum(1 for line in f) - 1}")
+            for filename, n_rows in list_categories():
+                print(f"{filename:<30} | {n_rows}")
+        sys.exit(0)
+
+    if args.serve:
+        if not os.path.exists(DATA_DIR):
+            print(f"❌ Error: Data directory not found at {DATA_DIR}")
+            sys.exit(1)
+        serve()
         sys.exit(0)
 
     if not args.query:
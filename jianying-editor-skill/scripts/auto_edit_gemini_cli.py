@@ -1,16 +1,26 @@
 from __future__ import annotations
 
 import argparse
+import functools
 import hashlib
+import itertools
 import json
 import os
+import re
 import shutil
+import string
 import subprocess
 import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from dataclasses import dataclass
-from typing import Any, Optional
+from typing import Any, Callable, Optional
 
-from gemini_cli_bridge import GeminiCliError, run_gemini_cli
+try:
+    import orjson  # optional: faster (de)serialization of the cache files
+except ImportError:
+    orjson = None
+
+from gemini_cli_bridge import GeminiCliError, GeminiCliResult, run_gemini_cli
 from media_storyboard import make_storyboard_image
 
 
@@ -25,6 +35,7 @@ if sys.platform == "win32" and hasattr(sys.stdout, "reconfigure"):
 
 VIDEO_EXTS = {".mp4", ".mov", ".mkv", ".avi", ".webm", ".m4v"}
 IMAGE_EXTS = {".jpg", ".jpeg", ".png", ".webp", ".bmp", ".gif"}
+_MEDIA_EXTS = frozenset(VIDEO_EXTS | IMAGE_EXTS)
 AUDIO_EXTS = {".mp3", ".wav", ".m4a", ".aac", ".flac"}
 
 DEFAULT_GEMINI_TEXT_MODEL = "gemini-3-pro-preview"
@@ -34,24 +45,79 @@ ALLOWED_TRANSITIONS = ["叠化", "闪白", "向左", "向右", "向上", "向下
 DEFAULT_TRANSITION = "叠化"
 
 
+@functools.lru_cache(maxsize=8192)
+def _cache_key(s: str) -> str:
+    """Non-cryptographic string key for cache file names (BLAKE2b-128, 32 hex chars)."""
+    return hashlib.blake2b(s.encode("utf-8", errors="ignore"), digest_size=16).hexdigest()
+
+
 def _sha1(s: str) -> str:
+    # Legacy key; only used to find cache files written by older versions.
     return hashlib.sha1(s.encode("utf-8", errors="ignore")).hexdigest()
 
 
+def _partial_content_key(path: str, chunk: int = 1 << 20) -> str:
+    """
+    Content-addressed cache key: BLAKE2b over the size plus the first and last `chunk` bytes
+    (rsync-style heuristic). Cost is bounded regardless of file size, and renames / mtime bumps
+    of identical bytes map to the same key. Files up to 2*chunk are hashed in full.
+    """
+    size = os.path.getsize(path)
+    h = hashlib.blake2b(str(size).encode("ascii"), digest_size=16)
+    with open(path, "rb") as f:
+        h.update(f.read(chunk))
+        if size > chunk:
+            f.seek(max(chunk, size - chunk))
+            h.update(f.read(chunk))
+    return h.hexdigest()
+
+
 def _ensure_dir(p: str) -> str:
     os.makedirs(p, exist_ok=True)
     return p
 
 
 def _read_text(path: str) -> str:
-    with open(path, "r", encoding="utf-8") as f:
-        return f.read()
+    # Binary read + one decode: skips the text-mode codec and newline translation layers.
+    # Callers that care (SRT parsing) normalize line endings themselves.
+    with open(path, "rb") as f:
+        return f.read().decode("utf-8")
 
 
 def _write_text(path: str, content: str) -> None:
     os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "wb") as f:
+        f.write(content.encode("utf-8"))
+
+
+def _read_json(path: str) -> Any:
+    with open(path, "rb") as f:
+        data = f.read()
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data.decode("utf-8"))
+
+
+def _write_json(path: str, obj: Any) -> None:
+    # Cache files only; prompts keep stdlib json so their text doesn't depend on what's installed.
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    if orjson is not None:
+        with open(path, "wb") as f:
+            f.write(orjson.dumps(obj, option=orjson.OPT_INDENT_2))
+        return
+    # Serialize straight into the file handle instead of building the whole string first.
     with open(path, "w", encoding="utf-8") as f:
-        f.write(content)
+        json.dump(obj, f, ensure_ascii=False, indent=2)
+
+
+# ```json ... ``` (language hint optional); group 1 is the stripped block body.
+_FENCE_RE = re.compile(r"```(?:json)?\s*(.+?)\s*```", re.DOTALL | re.IGNORECASE)
+
+
+def _next_json_start(s: str, i: int) -> int:
+    """Index of the next '{' or '[' at or after i, or -1."""
+    hits = [j for j in (s.find("{", i), s.find("[", i)) if j != -1]
+    return min(hits) if hits else -1
 
 
 def _extract_json_from_text(text: str) -> Any:
@@ -60,79 +126,53 @@ def _extract_json_from_text(text: str) -> Any:
 
     Gemini often wraps JSON in Markdown fences and the JSON object may contain inner arrays.
     Naive slicing like `text[text.find('['):text.rfind(']')]` can accidentally grab an inner array
-    (e.g. the value of `"tags": [...]`) instead of the whole object. We therefore scan and match
-    braces/brackets while respecting JSON strings.
+    (e.g. the value of `"tags": [...]`) instead of the whole object. We therefore decode from the
+    first `{`/`[` that starts a valid value and let the JSON parser find where it ends.
     """
     text = (text or "").strip()
     if not text:
         raise ValueError("empty response")
 
-    # Remove markdown fences if any. Prefer fenced blocks (odd indices), then fall back to the longest chunk.
+    # Remove markdown fences if any: prefer fenced blocks that look like JSON, then the longest.
+    # An unterminated fence is left alone; the scan below still finds the value inside it.
     if "```" in text:
-        chunks = text.split("```")
-        fenced = [chunks[i].strip() for i in range(1, len(chunks), 2) if chunks[i].strip()]
-        candidates = fenced if fenced else [c.strip() for c in chunks if c.strip()]
-        # Prefer chunks that look like they contain JSON.
-        candidates.sort(key=lambda s: (("{" in s) or ("[" in s), len(s)), reverse=True)
-        text = candidates[0] if candidates else ""
-
-        # Strip optional language hint like "json\n".
-        low = text.lstrip().lower()
-        if low.startswith("json"):
-            text = text.lstrip()[4:].strip()
-
-    def _find_span(s: str) -> tuple[int, int]:
-        start = -1
-        for i, ch in enumerate(s):
-            if ch in "{[":
-                start = i
-                break
-        if start == -1:
-            raise ValueError("no json start bracket found")
-
-        stack: list[str] = []
-        in_str = False
-        esc = False
-        for i in range(start, len(s)):
-            ch = s[i]
-            if in_str:
-                if esc:
-                    esc = False
-                    continue
-                if ch == "\\":
-                    esc = True
-                    continue
-                if ch == '"':
-                    in_str = False
-                continue
-
-            if ch == '"':
-                in_str = True
-                continue
-            if ch == "{":
-                stack.append("}")
-                continue
-            if ch == "[":
-                stack.append("]")
-                continue
-            if ch in "}]":
-                if not stack:
-                    continue
-                if ch != stack[-1]:
-                    continue
-                stack.pop()
-                if not stack:
-                    return start, i
+        best = max(
+            _FENCE_RE.finditer(text),
+            key=lambda m: (("{" in m.group(1)) or ("[" in m.group(1)), len(m.group(1))),
+            default=None,
+        )
+        if best is not None:
+            text = best.group(1)
+
+    # Let the C-accelerated decoder match braces/brackets (and skip strings) for us; raw_decode
+    # stops at the end of the first complete value. A start that fails before reaching the next
+    # bracket is prose (e.g. "[note]") and is skipped. One that fails past it encloses that bracket
+    # (truncated / trailing comma): raise rather than return a fragment nested inside it.
+    decoder = json.JSONDecoder()
+    i = _next_json_start(text, 0)
+    while i != -1:
+        try:
+            return decoder.raw_decode(text, i)[0]
+        except json.JSONDecodeError as e:
+            nxt = _next_json_start(text, i + 1)
+            if nxt != -1 and e.pos > nxt:
+                raise
+            i = nxt
 
-        raise ValueError("unterminated json value")
+    # Fall back to parsing the full text (raises a descriptive error).
+    return json.loads(text)
 
-    # Try extracting a balanced JSON substring first.
-    try:
-        s, e = _find_span(text)
-        return json.loads(text[s : e + 1])
-    except Exception:
-        # Fall back to parsing the full text.
-        return json.loads(text)
+
+def _parse_analysis(analysis: Any) -> tuple[list[str], str]:
+    """Normalize one {tags, desc} analysis object from Gemini."""
+    tags = analysis.get("tags") if isinstance(analysis, dict) else None
+    desc = analysis.get("desc") if isinstance(analysis, dict) else None
+    if not isinstance(tags, list):
+        tags = []
+    tags = [str(t).strip() for t in tags if str(t).strip()]
+    if not isinstance(desc, str):
+        desc = ""
+    return tags, desc
 
 
 def _sanitize_transition(name: Any, allowed: list[str]) -> str:
@@ -197,15 +237,15 @@ def _sanitize_matches(
     return out
 
 
+_SRT_TS_FMT = "{:02d}:{:02d}:{:02d},{:03d}".format
+
+
 def format_srt_timestamp(seconds: float) -> str:
     ms = int(round(seconds * 1000.0))
-    s = ms // 1000
-    ms = ms % 1000
-    m = s // 60
-    s = s % 60
-    h = m // 60
-    m = m % 60
-    return f"{h:02d}:{m:02d}:{s:02d},{ms:03d}"
+    s, ms = divmod(ms, 1000)
+    m, s = divmod(s, 60)
+    h, m = divmod(m, 60)
+    return _SRT_TS_FMT(h, m, s, ms)
 
 
 @dataclass
@@ -220,60 +260,85 @@ class SrtItem:
         return max(0.0, self.end - self.start)
 
 
+# One match per cue: a digit-only index line, the very next line containing "-->", then text
+# lines up to the first blank or digit-only line. Mirrors the old line-by-line scanner.
+_SRT_BLOCK_RE = re.compile(
+    r"^[^\S\n]*(\d+)[^\S\n]*\n"
+    r"([^\n]*-->[^\n]*)(?:\n|\Z)"
+    r"((?:^(?![^\S\n]*\d+[^\S\n]*$)(?=[^\n]*\S)[^\n]*(?:\n|\Z))*)",
+    re.MULTILINE,
+)
+
+
+def _parse_srt_time(t: str) -> float:
+    t = t.replace(",", ".")
+    parts = t.split(":")
+    if len(parts) != 3:
+        return 0.0
+    h, m, s = parts
+    return float(h) * 3600.0 + float(m) * 60.0 + float(s)
+
+
 def parse_srt_content(content: str) -> list[SrtItem]:
     content = content.replace("\r\n", "\n").replace("\r", "\n")
-    lines = [l.strip() for l in content.split("\n")]
 
     items: list[SrtItem] = []
-    i = 0
-    while i < len(lines):
-        if lines[i].isdigit() and i + 1 < len(lines) and "-->" in lines[i + 1]:
-            idx = int(lines[i])
-            time_line = lines[i + 1]
-            txt_lines: list[str] = []
-            j = i + 2
-            while j < len(lines) and lines[j] and not lines[j].isdigit():
-                txt_lines.append(lines[j])
-                j += 1
-
-            start_str, end_str = [p.strip() for p in time_line.split("-->")[:2]]
-
-            def _parse_time(t: str) -> float:
-                t = t.replace(",", ".")
-                parts = t.split(":")
-                if len(parts) != 3:
-                    return 0.0
-                h, m, s = parts
-                return float(h) * 3600.0 + float(m) * 60.0 + float(s)
-
-            start = _parse_time(start_str)
-            end = _parse_time(end_str)
-            text = " ".join([t for t in txt_lines if t]).strip()
-            items.append(SrtItem(idx=idx, start=start, end=end, text=text))
-            i = j
-            continue
-        i += 1
+    parse_time = _parse_srt_time
+    for m in _SRT_BLOCK_RE.finditer(content):
+        idx_str, time_line, body = m.groups()
+        start_str, _, end_str = time_line.partition("-->")
+        end_str = end_str.partition("-->")[0]
+        # Every captured text line is non-blank; only the trailing newline leaves an empty piece.
+        text = " ".join([l.strip() for l in body.rstrip("\n").split("\n")]) if body else ""
+        items.append(
+            SrtItem(idx=int(idx_str), start=parse_time(start_str.strip()), end=parse_time(end_str.strip()), text=text)
+        )
     return items
 
 
+@functools.lru_cache(maxsize=4)
+def _get_whisper(model_size: str, compute_type: str = "int8") -> Any:
+    """
+    Load a faster-whisper model once per process. Loading weights and the tokenizer takes
+    seconds, and CTranslate2 uses few threads unless told otherwise.
+    """
+    from faster_whisper import WhisperModel
+
+    return WhisperModel(
+        model_size,
+        device="cpu",
+        compute_type=compute_type,
+        cpu_threads=os.cpu_count() or 4,
+        num_workers=2,
+    )
+
+
 def transcribe_to_srt_faster_whisper(
     media_path: str,
     out_srt_path: str,
     *,
     model_size: str = "small",
     language: Optional[str] = None,
+    beam_size: int = 1,
 ) -> str:
     """
     Local transcription using faster-whisper. This avoids Gemini CLI audio limitations.
+    Defaults to greedy decoding (beam_size=1) without conditioning on previous text, the
+    fastest path; pass a larger beam_size for slightly better accuracy.
     """
-    from faster_whisper import WhisperModel
-
     media_path = os.path.abspath(media_path)
     out_srt_path = os.path.abspath(out_srt_path)
     os.makedirs(os.path.dirname(out_srt_path), exist_ok=True)
 
     # Conservative defaults for CPU.
-    model = WhisperModel(model_size, device="cpu", compute_type="int8")
+    model = _get_whisper(model_size, "int8")
+    transcribe = functools.partial(
+        model.transcribe,
+        language=language,
+        beam_size=max(1, beam_size),
+        condition_on_previous_text=False,
+        vad_filter=True,
+    )
 
     def _has_non_ascii(p: str) -> bool:
         try:
@@ -283,61 +348,72 @@ def transcribe_to_srt_faster_whisper(
             return True
 
     try:
-        segments, _info = model.transcribe(
-            media_path,
-            language=language,
-            vad_filter=True,
-        )
+        segments, _info = transcribe(media_path)
     except Exception as e:
-        # On some Windows builds, PyAV can't open Unicode paths. Work around by extracting
-        # a mono 16k WAV to an ASCII-safe cache path and transcribing that instead.
+        # On some Windows builds, PyAV can't open Unicode paths. Work around by decoding mono 16k
+        # audio with ffmpeg into memory (no temp file left behind) and transcribing the samples.
+        # Raw s16le rather than WAV: ffmpeg can't seek back on a pipe to fill in the RIFF sizes.
         if sys.platform == "win32" and (_has_non_ascii(media_path) or "Invalid argument" in str(e)):
-            tmp_wav = os.path.join(
-                os.path.dirname(out_srt_path),
-                f"fw_audio_{_sha1(media_path)}.wav",
-            )
-            if not os.path.exists(tmp_wav):
-                subprocess.run(
-                    [
-                        "ffmpeg",
-                        "-y",
-                        "-hide_banner",
-                        "-loglevel",
-                        "error",
-                        "-i",
-                        media_path,
-                        "-vn",
-                        "-ac",
-                        "1",
-                        "-ar",
-                        "16000",
-                        "-c:a",
-                        "pcm_s16le",
-                        tmp_wav,
-                    ],
-                    check=True,
-                )
-            segments, _info = model.transcribe(
-                tmp_wav,
-                language=language,
-                vad_filter=True,
+            import numpy as np  # faster-whisper dependency
+
+            proc = subprocess.run(
+                [
+                    "ffmpeg",
+                    "-hide_banner",
+                    "-loglevel",
+                    "error",
+                    "-threads",
+                    "0",
+                    "-i",
+                    media_path,
+                    "-vn",
+                    "-ac",
+                    "1",
+                    "-ar",
+                    "16000",
+                    "-f",
+                    "s16le",
+                    "pipe:1",
+                ],
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.PIPE,
+                check=True,
             )
+            # faster-whisper takes 16 kHz mono float32 in [-1, 1] directly.
+            audio = np.frombuffer(proc.stdout, dtype=np.int16).astype(np.float32) / 32768.0
+            segments, _info = transcribe(audio)
         else:
             raise
 
-    blocks: list[str] = []
+    # Stream cues straight to disk instead of building the whole transcript in memory.
+    # `segments` is lazy (decoding happens while iterating), so write to a temp file and only
+    # move it into place once transcription finished; a partial SRT would otherwise be reused
+    # as a cache hit on the next run.
+    tmp_path = out_srt_path + ".part"
     idx = 1
-    for seg in segments:
-        text = (seg.text or "").strip()
-        if not text:
-            continue
-        blocks.append(str(idx))
-        blocks.append(f"{format_srt_timestamp(seg.start)} --> {format_srt_timestamp(seg.end)}")
-        blocks.append(text)
-        blocks.append("")
-        idx += 1
-
-    _write_text(out_srt_path, "\n".join(blocks).strip() + "\n")
+    fmt_ts = format_srt_timestamp
+    try:
+        with open(tmp_path, "w", encoding="utf-8", newline="\n") as f:
+            write = f.write
+            for seg in segments:
+                text = (seg.text or "").strip()
+                if not text:
+                    continue
+                # Blank line between cues, none after the last one.
+                if idx > 1:
+                    write("\n")
+                write(f"{idx}\n{fmt_ts(seg.start)} --> {fmt_ts(seg.end)}\n{text}\n")
+                idx += 1
+            if idx == 1:
+                write("\n")
+        os.replace(tmp_path, out_srt_path)
+    except BaseException:
+        # Transcription failed (or was interrupted) midway: don't leave the partial file behind.
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
     return out_srt_path
 
 
@@ -351,6 +427,38 @@ class MaterialInfo:
     tags: list[str]
 
 
+def _scan_media_files(root: str) -> list[str]:
+    """
+    Iterative os.scandir walk (same traversal rules as os.walk: directory symlinks are not
+    followed, unreadable directories are skipped). DirEntry caches type info, so classifying
+    by extension needs no extra stat calls.
+    """
+    out: list[str] = []
+    stack = [root]
+    while stack:
+        d = stack.pop()
+        try:
+            it = os.scandir(d)
+        except OSError:
+            continue
+        with it:
+            for e in it:
+                try:
+                    is_dir = e.is_dir()
+                except OSError:
+                    is_dir = False
+                if is_dir:
+                    if not e.is_symlink():
+                        stack.append(e.path)
+                    continue
+                name = e.name
+                dot = name.rfind(".")
+                # Leading dots don't start an extension (matches os.path.splitext).
+                if dot > 0 and name[dot:].lower() in _MEDIA_EXTS and name[:dot].strip("."):
+                    out.append(e.path)
+    return out
+
+
 def collect_material_files(inputs: list[str], *, limit: int = 0) -> list[str]:
     files: list[str] = []
     for inp in inputs:
@@ -359,11 +467,7 @@ def collect_material_files(inputs: list[str], *, limit: int = 0) -> list[str]:
             files.append(p)
             continue
         if os.path.isdir(p):
-            for root, _dirs, fs in os.walk(p):
-                for name in fs:
-                    ext = os.path.splitext(name)[1].lower()
-                    if ext in VIDEO_EXTS or ext in IMAGE_EXTS:
-                        files.append(os.path.join(root, name))
+            files.extend(_scan_media_files(p))
     # Stable order
     files = sorted(set(files))
     if limit and limit > 0:
@@ -371,29 +475,157 @@ def collect_material_files(inputs: list[str], *, limit: int = 0) -> list[str]:
     return files
 
 
-def _copy_into_cache(src_path: str, cache_media_dir: str) -> str:
-    src_path = os.path.abspath(src_path)
-    ext = os.path.splitext(src_path)[1].lower()
-    key = _sha1(src_path + str(os.path.getmtime(src_path)))
+# (src path, mtime, cache dir) -> cached copy; repeat lookups in one run skip stat/hash/exists.
+_copy_memo: dict[tuple[str, float, str], str] = {}
+
+
+def _prep_material_paths(paths: list[str]) -> list[tuple[str, str, float]]:
+    """Normalize each path once: (absolute path, lowercased extension, mtime or 0.0)."""
+    out: list[tuple[str, str, float]] = []
+    for p in paths:
+        abs_p = os.path.abspath(p)
+        try:
+            mtime = os.path.getmtime(abs_p)
+        except Exception:
+            mtime = 0.0
+        out.append((abs_p, os.path.splitext(abs_p)[1].lower(), mtime))
+    return out
+
+
+def _copy_into_cache(
+    src_path: str,
+    cache_media_dir: str,
+    mtime: Optional[float] = None,
+    ext: Optional[str] = None,
+) -> str:
+    """Copy into the cache. Pass `mtime`/`ext` from _prep_material_paths to skip re-deriving them."""
+    if mtime is None or ext is None:
+        src_path = os.path.abspath(src_path)
+        ext = os.path.splitext(src_path)[1].lower()
+        if mtime is None:
+            mtime = os.path.getmtime(src_path)
+    memo_key = (src_path, mtime, cache_media_dir)
+    dst = _copy_memo.get(memo_key)
+    if dst is not None:
+        return dst
+
+    # Keyed by content, so a renamed/touched copy of the same file is not copied again.
+    key = _partial_content_key(src_path)
     dst = os.path.join(cache_media_dir, f"{key}{ext}")
     if not os.path.exists(dst):
         _ensure_dir(cache_media_dir)
         shutil.copy2(src_path, dst)
+    _copy_memo[memo_key] = dst
     return dst
 
 
+def _cached_gemini_call(
+    prompt: str,
+    *,
+    cache_dir: str,
+    force: bool = False,
+    model: Optional[str] = None,
+    stdin_text: str,
+    include_directories: list[str],
+    cwd: str,
+    timeout_s: int,
+    accept: Callable[[Any], bool],
+) -> GeminiCliResult:
+    """
+    run_gemini_cli() memoized on disk under `cache_dir/prompt_cache/`, keyed by the prompt, stdin,
+    model and include dirs. Media inputs are referenced by content-keyed cache paths, so the key
+    changes whenever the pixels do. Only replies whose parsed JSON passes `accept` (the caller's
+    shape check) are stored or served, so a truncated / wrong-shaped reply is retried on the next
+    run; `force` skips the lookup but still refreshes the entry.
+    """
+    key_material = json.dumps([prompt, stdin_text, model, include_directories], ensure_ascii=False)
+    memo_path = os.path.join(cache_dir, "prompt_cache", f"{_cache_key(key_material)}.txt")
+    if (not force) and os.path.exists(memo_path):
+        try:
+            response = _read_text(memo_path)
+            if accept(_extract_json_from_text(response)):
+                return GeminiCliResult(session_id=None, response=response, raw={}, stdout="", stderr="", returncode=0)
+        except Exception:
+            pass
+
+    g = run_gemini_cli(
+        prompt,
+        model=model,
+        stdin_text=stdin_text,
+        include_directories=include_directories,
+        cwd=cwd,
+        timeout_s=timeout_s,
+    )
+    try:
+        if accept(_extract_json_from_text(g.response)):
+            _write_text(memo_path, g.response)
+    except Exception:
+        pass
+    return g
+
+
+def _is_analysis(value: Any) -> bool:
+    """Shape of a single-file vision reply: {tags: [...], desc: "..."}."""
+    return isinstance(value, dict) and isinstance(value.get("tags"), list) and isinstance(value.get("desc"), str)
+
+
+def _is_match_list(value: Any) -> bool:
+    """Shape of a matching reply: a list of match dicts."""
+    return isinstance(value, list) and all(isinstance(m, dict) for m in value)
+
+
+def _batch_indices_ok(value: Any, n: int) -> bool:
+    """Shape of a batch vision reply: n dicts whose `i` fields are exactly 1..n."""
+    if not isinstance(value, list) or len(value) != n or not all(isinstance(a, dict) for a in value):
+        return False
+    try:
+        return sorted(int(a.get("i")) for a in value) == list(range(1, n + 1))
+    except (TypeError, ValueError):
+        return False
+
+
+# Replies from a forced text-only model that can't read the image.
+_VISION_REFUSAL_MARKERS = (
+    "无法直接分析图片",
+    "cannot directly analyze",
+    "only return raw data",
+    "只能返回图片的原始数据",
+)
+
+
+def _is_vision_refusal(response: Optional[str]) -> bool:
+    return any(s in (response or "") for s in _VISION_REFUSAL_MARKERS)
+
+
+def _looks_like_file_metadata(tags: list[str], desc: str) -> bool:
+    """The model described the cached file (path/hash/format) instead of the picture."""
+    if not desc:
+        return False
+    meta_markers = [".gemini_cache", "缓存", "目录", "文件名", "哈希", "media"]
+    tag_markers = {"png", "jpg", "jpeg", "webp", "image", "file", "media", "cache", "文件", "图片"}
+    return any(m in desc for m in meta_markers) and any((str(t).strip().lower() in tag_markers) for t in tags)
+
+
+def _is_unusable_analysis(tags: list[str], desc: str) -> bool:
+    return (not tags and not desc) or _looks_like_file_metadata(tags, desc)
+
+
 def analyze_materials_with_gemini(
     material_paths: list[str],
     *,
     cache_dir: str,
     vision_model: Optional[str] = None,
     force: bool = False,
+    max_workers: int = 8,
+    batch_size: int = 10,
 ) -> list[MaterialInfo]:
     """
     For each material file, generate a cached visual proxy inside workspace:
     - video -> storyboard image (contact sheet)
     - image -> copy into cache (so Gemini can read it in-workspace)
     Then ask Gemini CLI to output JSON: {tags: [...], desc: "..."}.
+    Uncached materials are sent `batch_size` images per Gemini CLI call, with up to `max_workers`
+    calls in flight.
     """
     cache_dir = os.path.abspath(cache_dir)
     cache_media_dir = _ensure_dir(os.path.join(cache_dir, "media"))
@@ -403,11 +635,10 @@ def analyze_materials_with_gemini(
     cache: dict[str, Any] = {}
     if os.path.exists(cache_json_path):
         try:
-            cache = json.loads(_read_text(cache_json_path))
+            cache = _read_json(cache_json_path)
         except Exception:
             cache = {}
 
-    results: list[MaterialInfo] = []
     workspace_root = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
 
     def _rel(p: str) -> str:
@@ -416,40 +647,33 @@ def analyze_materials_with_gemini(
         except Exception:
             return p
 
-    for p in material_paths:
-        abs_p = os.path.abspath(p)
-        ext = os.path.splitext(abs_p)[1].lower()
-        kind = "video" if ext in VIDEO_EXTS else "image"
-        mtime = 0.0
-        try:
-            mtime = os.path.getmtime(abs_p)
-        except Exception:
-            pass
-
-        cached = cache.get(abs_p)
-        if (not force) and cached and float(cached.get("mtime", 0)) == float(mtime):
-            results.append(
-                MaterialInfo(
-                    id=len(results),
-                    path=abs_p,
-                    kind=cached.get("kind", kind),
-                    duration=float(cached.get("duration", 0.0)),
-                    desc=str(cached.get("desc", "")),
-                    tags=list(cached.get("tags", [])),
-                )
-            )
-            continue
+    def _vision_call(stdin_prompt: str, model: Optional[str], accept: Callable[[Any], bool]):
+        return _cached_gemini_call(
+            "读取STDIN并按要求只输出JSON。",
+            cache_dir=cache_dir,
+            force=force,
+            model=model,
+            stdin_text=stdin_prompt,
+            include_directories=[workspace_root, cache_dir],
+            cwd=workspace_root,
+            timeout_s=600,
+            accept=accept,
+        )
 
+    def _prepare(
+        abs_p: str, kind: str, ext: str, mtime: float, cached: Optional[dict[str, Any]]
+    ) -> tuple[str, float]:
+        """Build the Gemini-readable image for one material. Returns (vision_image, duration)."""
         # Build a Gemini-readable image inside workspace.
         if kind == "video":
-            # Storyboard output is stable per file+mtime.
-            key = _sha1(abs_p + str(mtime))
+            # Storyboard output depends on pixel content only, so key it by content.
+            key = _partial_content_key(abs_p)
             storyboard_path = os.path.join(cache_story_dir, f"{key}.jpg")
             if not os.path.exists(storyboard_path):
                 make_storyboard_image(abs_p, storyboard_path)
             vision_image = storyboard_path
         else:
-            vision_image = _copy_into_cache(abs_p, cache_media_dir)
+            vision_image = _copy_into_cache(abs_p, cache_media_dir, mtime, ext)
 
         # Quick duration (video only). For images, duration is 0; timeline duration comes from SRT.
         duration = 0.0
@@ -457,6 +681,13 @@ def analyze_materials_with_gemini(
             # Use ffprobe via storyboard module (already called inside make_storyboard).
             # To avoid extra probe calls, estimate duration from cache if present; else leave 0.
             duration = float(cached.get("duration", 0.0)) if cached else 0.0
+        return vision_image, duration
+
+    def _analyze_one(
+        abs_p: str, kind: str, ext: str, mtime: float, cached: Optional[dict[str, Any]]
+    ) -> dict[str, Any]:
+        """Ask Gemini for tags/desc of a single material and return its cache entry."""
+        vision_image, duration = _prepare(abs_p, kind, ext, mtime, cached)
 
         stdin_prompt = (
             "你是专业短视频剪辑助手。\n"
@@ -470,26 +701,11 @@ def analyze_materials_with_gemini(
 
         try:
             def _call(model: Optional[str]):
-                return run_gemini_cli(
-                    "读取STDIN并按要求只输出JSON。",
-                    model=model,
-                    stdin_text=stdin_prompt,
-                    include_directories=[workspace_root, cache_dir],
-                    cwd=workspace_root,
-                    timeout_s=600,
-                )
+                return _vision_call(stdin_prompt, model, _is_analysis)
 
             g = _call(vision_model)
             # If user forced a text-only model, auto-fallback to CLI default for vision.
-            if vision_model and any(
-                s in (g.response or "")
-                for s in [
-                    "无法直接分析图片",
-                    "cannot directly analyze",
-                    "only return raw data",
-                    "只能返回图片的原始数据",
-                ]
-            ):
+            if vision_model and _is_vision_refusal(g.response):
                 g = _call(None)
 
             try:
@@ -501,24 +717,9 @@ def analyze_materials_with_gemini(
                     analysis = _extract_json_from_text(g.response)
                 else:
                     raise
-            tags = analysis.get("tags") if isinstance(analysis, dict) else None
-            desc = analysis.get("desc") if isinstance(analysis, dict) else None
-            if not isinstance(tags, list):
-                tags = []
-            tags = [str(t).strip() for t in tags if str(t).strip()]
-            if not isinstance(desc, str):
-                desc = ""
-
-            def _looks_like_file_metadata(_tags: list[str], _desc: str) -> bool:
-                if not _desc:
-                    return False
-                meta_markers = [".gemini_cache", "缓存", "目录", "文件名", "哈希", "media"]
-                tag_markers = {"png", "jpg", "jpeg", "webp", "image", "file", "media", "cache", "文件", "图片"}
-                return any(m in _desc for m in meta_markers) and any(
-                    (str(t).strip().lower() in tag_markers) for t in _tags
-                )
+            tags, desc = _parse_analysis(analysis)
 
-            if vision_model and ((not tags and not desc) or _looks_like_file_metadata(tags, desc)):
+            if vision_model and _is_unusable_analysis(tags, desc):
                 # Helpful debug + retry: some forced models won't do vision reliably.
                 try:
                     raw_path = os.path.join(cache_dir, "analysis_raw_last.txt")
@@ -526,14 +727,7 @@ def analyze_materials_with_gemini(
                 except Exception:
                     pass
                 g = _call(None)
-                analysis = _extract_json_from_text(g.response)
-                tags = analysis.get("tags") if isinstance(analysis, dict) else None
-                desc = analysis.get("desc") if isinstance(analysis, dict) else None
-                if not isinstance(tags, list):
-                    tags = []
-                tags = [str(t).strip() for t in tags if str(t).strip()]
-                if not isinstance(desc, str):
-                    desc = ""
+                tags, desc = _parse_analysis(_extract_json_from_text(g.response))
         except GeminiCliError as e:
             tags, desc = [], ""
             print(f"[warn] Gemini analyze failed for: {abs_p}\n  {e}")
@@ -541,7 +735,7 @@ def analyze_materials_with_gemini(
             tags, desc = [], ""
             print(f"[warn] Parse failed for: {abs_p}\n  {e}")
 
-        cache[abs_p] = {
+        return {
             "mtime": mtime,
             "kind": kind,
             "duration": duration,
@@ -549,22 +743,158 @@ def analyze_materials_with_gemini(
             "desc": desc,
             "vision_image": vision_image,
         }
-        _write_text(cache_json_path, json.dumps(cache, ensure_ascii=False, indent=2))
 
+    def _analyze_batch(
+        items: list[tuple[str, str, str, float, Optional[dict[str, Any]]]],
+    ) -> list[tuple[str, dict[str, Any]]]:
+        """
+        Describe several materials with a single Gemini call (one numbered image list in, one JSON array out).
+        Falls back to per-file calls when the batch reply can't be mapped back to every image.
+        """
+        if len(items) == 1:
+            return [(items[0][0], _analyze_one(*items[0]))]
+
+        prepared = [_prepare(*it) for it in items]
+        listing = "\n".join(f"图片{i}：{_rel(img)}" for i, (img, _dur) in enumerate(prepared, 1))
+        stdin_prompt = (
+            "你是专业短视频剪辑助手。\n"
+            f"请依次读取以下 {len(items)} 个图片文件：\n{listing}\n\n"
+            "任务：分别用中文总结每张图片的画面内容。\n"
+            "输出要求：只输出一个 JSON 数组（不要 Markdown，不要代码块，不要任何解释文字），"
+            "每张图片恰好对应一个元素，按图片编号顺序排列，元素字段如下：\n"
+            "- i: 整数，图片编号\n"
+            "- tags: 字符串数组，3-8 个中文短标签（不要包含文件名）\n"
+            "- desc: 字符串，1-2 句中文描述\n"
+            "标签尽量用通用语义词（人物/动作/场景/物体）。\n"
+        )
+
+        def _is_batch(value: Any) -> bool:
+            return _batch_indices_ok(value, len(items))
+
+        def _parse_batch(response: str) -> dict[int, tuple[list[str], str]]:
+            analyses = _extract_json_from_text(response)
+            if not _is_batch(analyses):
+                raise ValueError(f"expected a JSON array of {len(items)} items covering every image index")
+            return {int(a.get("i")): _parse_analysis(a) for a in analyses}
+
+        try:
+            g = _vision_call(stdin_prompt, vision_model, _is_batch)
+            if vision_model:
+                # Same fallbacks as _analyze_one: a refusal, an unparsable / wrong-length reply or an
+                # empty / file-metadata description from a forced model is retried on the CLI default.
+                try:
+                    if _is_vision_refusal(g.response):
+                        raise ValueError("forced model refused to read the images")
+                    by_index = _parse_batch(g.response)
+                    if any(_is_unusable_analysis(*td) for td in by_index.values()):
+                        try:
+                            _write_text(os.path.join(cache_dir, "analysis_raw_last.txt"), g.response or "")
+                        except Exception:
+                            pass
+                        raise ValueError("forced model returned empty / file-metadata analyses")
+                except ValueError:
+                    by_index = _parse_batch(_vision_call(stdin_prompt, None, _is_batch).response)
+            else:
+                by_index = _parse_batch(g.response)
+        except Exception as e:
+            print(f"[warn] Batch analyze failed for {len(items)} files, retrying one by one\n  {e}")
+            return [(it[0], _analyze_one(*it)) for it in items]
+
+        out: list[tuple[str, dict[str, Any]]] = []
+        for i, ((abs_p, kind, _ext, mtime, _cached), (vision_image, duration)) in enumerate(zip(items, prepared), 1):
+            tags, desc = by_index[i]
+            out.append(
+                (
+                    abs_p,
+                    {
+                        "mtime": mtime,
+                        "kind": kind,
+                        "duration": duration,
+                        "tags": tags,
+                        "desc": desc,
+                        "vision_image": vision_image,
+                    },
+                )
+            )
+        return out
+
+    # Resolve cache hits up front; everything else is analyzed in batches of `batch_size` images per
+    # Gemini call, with batches running concurrently (CLI calls are I/O-bound).
+    abs_paths: list[str] = []
+    entries: list[Optional[dict[str, Any]]] = []
+    pending: dict[str, tuple[str, str, float, Optional[dict[str, Any]]]] = {}
+    for abs_p, ext, mtime in _prep_material_paths(material_paths):
+        kind = "video" if ext in VIDEO_EXTS else "image"
+        abs_paths.append(abs_p)
+        cached = cache.get(abs_p)
+        if (not force) and cached and float(cached.get("mtime", 0)) == float(mtime):
+            entries.append({**cached, "kind": cached.get("kind", kind)})
+            continue
+        entries.append(None)
+        pending.setdefault(abs_p, (kind, ext, mtime, cached))
+
+    if pending:
+        todo = iter([(abs_p, *rest) for abs_p, rest in pending.items()])
+        batches = list(iter(lambda: list(itertools.islice(todo, max(1, batch_size))), []))
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(batches)))) as ex:
+            futures = [ex.submit(_analyze_batch, b) for b in batches]
+            unsaved = 0
+            try:
+                for fut in as_completed(futures):
+                    done = fut.result()
+                    cache.update(done)
+                    # Checkpoint every ~16 analyzed items instead of rewriting the whole cache
+                    # after every batch.
+                    unsaved += len(done)
+                    if unsaved >= 16:
+                        _write_json(cache_json_path, cache)
+                        unsaved = 0
+            finally:
+                # Keep finished work even if a batch raised or the run was interrupted.
+                if unsaved:
+                    _write_json(cache_json_path, cache)
+
+    # Ids follow the input order (not completion order) so matching stays reproducible.
+    results: list[MaterialInfo] = []
+    for i, abs_p in enumerate(abs_paths):
+        entry = entries[i] or cache[abs_p]
         results.append(
             MaterialInfo(
-                id=len(results),
+                id=i,
                 path=abs_p,
-                kind=kind,
-                duration=duration,
-                desc=desc,
-                tags=tags,
+                kind=entry["kind"],
+                duration=float(entry.get("duration", 0.0)),
+                desc=str(entry.get("desc", "")),
+                tags=list(entry.get("tags", [])),
             )
         )
 
     return results
 
 
+_MATCH_PROMPT_HEAD = (
+    "你是专业短视频剪辑师，请把字幕段落匹配到最合适的素材。\n"
+    "${style}"
+    "素材列表（JSON）：\n${mats_json}"
+    "\n\n字幕段（JSON）：\n${subs_json}"
+    "\n\n输出严格JSON数组（不要Markdown，不要解释）。输出要求：\n"
+    "- 数组长度必须等于字幕段数量（上面字幕段 JSON 的元素个数），不得省略任何段。\n"
+    "- 数组顺序必须与字幕段顺序一致。\n"
+    "- 每个字幕段恰好输出一条记录：{\"srt_idx\": <字幕idx>, \"id\": <素材id或null>, \"transition\": <转场名>}。\n"
+    "- 如果没有合适素材，id 设为 null。\n"
+)
+_MATCH_PROMPT_TAIL = "- transition 必须从以下列表选择：${transitions_json}\n"
+# Keyed by allow_reuse.
+_MATCH_PROMPT_TMPL = {
+    True: string.Template(_MATCH_PROMPT_HEAD + "- 素材可以重复使用。\n" + _MATCH_PROMPT_TAIL),
+    False: string.Template(
+        _MATCH_PROMPT_HEAD
+        + "- 每个素材 id 最多使用一次；如果素材不足，优先保证关键字幕段，其余段 id= null。\n"
+        + _MATCH_PROMPT_TAIL
+    ),
+}
+
+
 def gemini_match_srt_to_materials(
     srt_items: list[SrtItem],
     materials: list[MaterialInfo],
@@ -580,7 +910,7 @@ def gemini_match_srt_to_materials(
     cache_json_path = os.path.join(cache_dir, "srt_matches.json")
     if (not force) and os.path.exists(cache_json_path):
         try:
-            return json.loads(_read_text(cache_json_path))
+            return _read_json(cache_json_path)
         except Exception:
             pass
 
@@ -609,31 +939,24 @@ def gemini_match_srt_to_materials(
 
     transitions = ALLOWED_TRANSITIONS
 
-    stdin_prompt = (
-        "你是专业短视频剪辑师，请把字幕段落匹配到最合适的素材。\n"
-        + (f"风格提示：{style_hint}\n" if style_hint else "")
-        + "素材列表（JSON）：\n"
-        + json.dumps(mats, ensure_ascii=False)
-        + "\n\n字幕段（JSON）：\n"
-        + json.dumps(subs, ensure_ascii=False)
-        + "\n\n输出严格JSON数组（不要Markdown，不要解释）。输出要求：\n"
-        + "- 数组长度必须等于字幕段数量（上面字幕段 JSON 的元素个数），不得省略任何段。\n"
-        + "- 数组顺序必须与字幕段顺序一致。\n"
-        + "- 每个字幕段恰好输出一条记录：{\"srt_idx\": <字幕idx>, \"id\": <素材id或null>, \"transition\": <转场名>}。\n"
-        + "- 如果没有合适素材，id 设为 null。\n"
-        + ("- 素材可以重复使用。\n" if allow_reuse else "- 每个素材 id 最多使用一次；如果素材不足，优先保证关键字幕段，其余段 id= null。\n")
-        + "- transition 必须从以下列表选择："
-        + json.dumps(transitions, ensure_ascii=False)
-        + "\n"
+    # Serialize each payload once; the rest of the prompt is a template prepared at import time.
+    stdin_prompt = _MATCH_PROMPT_TMPL[bool(allow_reuse)].substitute(
+        style=f"风格提示：{style_hint}\n" if style_hint else "",
+        mats_json=json.dumps(mats, ensure_ascii=False),
+        subs_json=json.dumps(subs, ensure_ascii=False),
+        transitions_json=json.dumps(transitions, ensure_ascii=False),
     )
 
-    g = run_gemini_cli(
+    g = _cached_gemini_call(
         "按STDIN中的规则输出JSON数组（只输出JSON，不要Markdown）。",
+        cache_dir=cache_dir,
+        force=force,
         model=text_model,
         stdin_text=stdin_prompt,
         include_directories=[workspace_root, cache_dir],
         cwd=workspace_root,
         timeout_s=600,
+        accept=_is_match_list,
     )
 
     try:
@@ -668,7 +991,7 @@ def gemini_match_srt_to_materials(
                 m["id"] = i if i < len(materials) else None
                 m["transition"] = _sanitize_transition(m.get("transition"), transitions)
 
-    _write_text(cache_json_path, json.dumps(matches, ensure_ascii=False, indent=2))
+    _write_json(cache_json_path, matches)
     return matches
 
 
@@ -694,11 +1017,14 @@ def main() -> int:
     ap.add_argument("--cache-dir", default=None, help="Cache dir (default: <workspace>/.gemini_cache)")
     ap.add_argument("--limit-materials", type=int, default=0, help="Limit number of materials scanned/analyzed")
     ap.add_argument("--force", action="store_true", help="Force re-run Gemini analysis/matching (ignore cache)")
+    ap.add_argument("--gemini-workers", type=int, default=8, help="Max concurrent Gemini CLI calls for material analysis")
+    ap.add_argument("--analyze-batch-size", type=int, default=10, help="Materials per Gemini vision call (1 = one call per file)")
     ap.add_argument("--allow-reuse", action="store_true", help="Allow reuse of the same material id")
     ap.add_argument("--transition-duration", default="0.35s", help="Transition duration (e.g. 0.3s)")
     ap.add_argument("--mute-main-video", action="store_true", help="If --main is video, set its volume to 0")
     ap.add_argument("--whisper-model", default="small", help="faster-whisper model size (if transcribing)")
     ap.add_argument("--whisper-lang", default=None, help="Language code hint for whisper (e.g. zh)")
+    ap.add_argument("--whisper-beam-size", type=int, default=1, help="Beam size for whisper decoding (1 = greedy, fastest)")
     args = ap.parse_args()
 
     scripts_dir = os.path.dirname(os.path.abspath(__file__))
@@ -724,7 +1050,10 @@ def main() -> int:
         main_path = os.path.abspath(args.main)
         if not os.path.exists(main_path):
             raise SystemExit(f"Main file not found: {main_path}")
-        srt_path = os.path.join(cache_dir, f"transcribed_{_sha1(main_path)}.srt")
+        srt_path = os.path.join(cache_dir, f"transcribed_{_cache_key(main_path)}.srt")
+        legacy_srt_path = os.path.join(cache_dir, f"transcribed_{_sha1(main_path)}.srt")
+        if not args.force and not os.path.exists(srt_path) and os.path.exists(legacy_srt_path):
+            srt_path = legacy_srt_path
         if args.force or (not os.path.exists(srt_path)):
             print(f"[1/4] Transcribing -> {srt_path}")
             transcribe_to_srt_faster_whisper(
@@ -732,6 +1061,7 @@ def main() -> int:
                 srt_path,
                 model_size=args.whisper_model,
                 language=args.whisper_lang,
+                beam_size=args.whisper_beam_size,
             )
         else:
             print(f"[1/4] Using cached SRT: {srt_path}")
@@ -755,6 +1085,8 @@ def main() -> int:
         cache_dir=cache_dir,
         vision_model=vision_model,
         force=args.force,
+        max_workers=args.gemini_workers,
+        batch_size=args.analyze_batch_size,
     )
 
     # 3) Gemini match
@@ -794,8 +1126,18 @@ def main() -> int:
     project.import_subtitles(srt_path)
 
     # Build quick lookup for SRT items by idx (SRT idx is 1-based and may skip).
-    sub_by_idx = {it.idx: it for it in srt_items}
-    mat_by_id = {m.id: m for m in materials}
+    # SRT indices are 1-based and normally contiguous: index a list directly. Oddly numbered
+    # files (huge/sparse indices) keep a dict; both raise LookupError on a miss.
+    max_idx = max((it.idx for it in srt_items), default=0)
+    sub_by_idx: list[Optional[SrtItem]] | dict[int, SrtItem]
+    if max_idx <= 2 * len(srt_items) + 16:
+        sub_by_idx = [None] * (max_idx + 1)
+        for it in srt_items:
+            sub_by_idx[it.idx] = it
+    else:
+        sub_by_idx = {it.idx: it for it in srt_items}
+    # Material ids are assigned 0..n-1 in order by analyze_materials_with_gemini().
+    n_materials = len(materials)
 
     broll_track = "Broll"
     added = 0
@@ -804,7 +1146,12 @@ def main() -> int:
             srt_idx = int(m.get("srt_idx"))
         except Exception:
             continue
-        sub = sub_by_idx.get(srt_idx)
+        if srt_idx < 0:
+            continue
+        try:
+            sub = sub_by_idx[srt_idx]
+        except LookupError:
+            continue
         if not sub or not sub.text:
             continue
 
@@ -816,9 +1163,9 @@ def main() -> int:
         except Exception:
             continue
 
-        mat = mat_by_id.get(mid_int)
-        if not mat:
+        if not 0 <= mid_int < n_materials:
             continue
+        mat = materials[mid_int]
 
         start_time = f"{sub.start:.3f}s"
         duration = f"{sub.duration:.3f}s"
@@ -1,7 +1,9 @@
 import argparse
 import os
-import subprocess
 import sys
+from concurrent.futures import Future
+
+import ffmpeg_pool
 
 
 def _require_file(path: str) -> str:
@@ -11,9 +13,40 @@ def _require_file(path: str) -> str:
     return path
 
 
-def _run(cmd: list[str]) -> None:
+def _run(cmd: list[str]) -> Future:
+    # Runs on the shared ffmpeg pool; call .result() to wait (raises CalledProcessError on failure).
     # Keep stdout/stderr attached so ffmpeg progress/errors are visible.
-    subprocess.run(cmd, check=True)
+    return ffmpeg_pool.submit(cmd, check=True)
+
+
+def _probe_audio_codec(path: str) -> str:
+    """codec_name of the first audio stream (e.g. "aac", "mp3"), or "" if unknown."""
+    try:
+        r = ffmpeg_pool.run(
+            [
+                "ffprobe",
+                "-v",
+                "error",
+                "-select_streams",
+                "a:0",
+                "-show_entries",
+                "stream=codec_name",
+                "-of",
+                "default=nokey=1:noprint_wrappers=1",
+                path,
+            ],
+            capture_output=True,
+            text=True,
+            encoding="utf-8",
+            timeout=60,
+        )
+        return (r.stdout or "").strip().lower() if r.returncode == 0 else ""
+    except Exception:
+        return ""
+
+
+# Source audio codecs that can be stream-copied into a container JianYing imports: codec -> extension.
+_COPYABLE_AUDIO = {"mp3": ".mp3", "aac": ".m4a"}
 
 
 def main() -> int:
@@ -34,7 +67,12 @@ def main() -> int:
     parser.add_argument(
         "--audio-bitrate",
         default="192k",
-        help="MP3 bitrate used when extracting audio (default: 192k).",
+        help="MP3 bitrate used when re-encoding audio (default: 192k).",
+    )
+    parser.add_argument(
+        "--force-mp3",
+        action="store_true",
+        help="Always re-encode to MP3. Default: stream-copy when the source audio is already MP3/AAC.",
     )
     parser.add_argument(
         "--mute-video",
@@ -68,13 +106,21 @@ def main() -> int:
     # Keep extracted audio inside the draft folder, so the project is self-contained.
     temp_assets_dir = os.path.join(project.root, project.name, "temp_assets")
     os.makedirs(temp_assets_dir, exist_ok=True)
-    audio_out = os.path.join(temp_assets_dir, "extracted_audio.mp3")
+
+    # MP3/AAC sources are copied as-is (no decode/encode); everything else is re-encoded to MP3.
+    copy_ext = None if args.force_mp3 else _COPYABLE_AUDIO.get(_probe_audio_codec(video_path))
+    audio_out = os.path.join(temp_assets_dir, "extracted_audio" + (copy_ext or ".mp3"))
+    if copy_ext:
+        codec_args = ["-c:a", "copy"]
+    else:
+        codec_args = ["-c:a", "libmp3lame", "-b:a", str(args.audio_bitrate)]
 
     print(f"🎬 Video: {video_path}")
     print(f"🎵 Audio: {audio_out}")
 
-    # Extract audio (re-encode to MP3 for broad compatibility).
-    _run(
+    # Extract audio. Runs in the background while the video clip is imported, which doesn't
+    # depend on it.
+    extract_job = _run(
         [
             "ffmpeg",
             "-y",
@@ -84,10 +130,7 @@ def main() -> int:
             "-i",
             video_path,
             "-vn",
-            "-c:a",
-            "libmp3lame",
-            "-b:a",
-            str(args.audio_bitrate),
+            *codec_args,
             audio_out,
         ]
     )
@@ -96,6 +139,7 @@ def main() -> int:
     if video_seg and args.mute_video:
         video_seg.volume = 0.0
 
+    extract_job.result()
     project.add_audio_safe(audio_out, start_time="0s", track_name=args.audio_track)
     project.save()
 
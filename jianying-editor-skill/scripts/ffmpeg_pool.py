@@ -0,0 +1,41 @@
+"""
+Process-wide pool for ffmpeg/ffprobe invocations.
+
+Callers that fan out (e.g. material analysis running several Gemini batches at once) would
+otherwise start one ffmpeg per thread and oversubscribe the CPU. Jobs submitted here run through
+a single ThreadPoolExecutor capped at the vCPU count, and callers that have independent work can
+keep going while the job runs and collect the result later.
+"""
+
+from __future__ import annotations
+
+import os
+import subprocess
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Any, Optional
+
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _executor() -> ThreadPoolExecutor:
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadPoolExecutor(max_workers=os.cpu_count() or 4, thread_name_prefix="ffmpeg")
+    return _pool
+
+
+def submit(cmd: list[str], **kwargs: Any) -> Future:
+    """
+    Run `subprocess.run(cmd, **kwargs)` on the shared pool. The future resolves to the
+    CompletedProcess (or raises, e.g. CalledProcessError with check=True).
+    """
+    return _executor().submit(subprocess.run, cmd, **kwargs)
+
+
+def run(cmd: list[str], **kwargs: Any) -> subprocess.CompletedProcess:
+    """Blocking helper: submit and wait."""
+    return submit(cmd, **kwargs).result()
@@ -1,12 +1,20 @@
 from __future__ import annotations
 
+import asyncio
 import json
 import os
+import re
+import shutil
 import subprocess
-import tempfile
+import time
 from dataclasses import dataclass
 from typing import Optional
 
+try:
+    import orjson  # optional: faster parsing of large CLI replies
+except ImportError:
+    orjson = None
+
 
 class GeminiCliError(RuntimeError):
     pass
@@ -22,25 +30,220 @@ class GeminiCliResult:
     returncode: int
 
 
-def _ps_quote(s: str) -> str:
-    # Single-quote for PowerShell literal string.
-    return "'" + s.replace("'", "''") + "'"
+# Replies meaning "ready, waiting for a command" (the CLI ignored our prompt). Matched against the
+# lowercased response in one regex scan.
+_BOOTSTRAP_MARKERS = (
+    "ready for your first command",
+    "please provide your first command",
+    "waiting for your command",
+    "what can i do for you",
+    "what would you like me to do",
+    "i am ready for your first command",
+    "i'm ready for your first command",
+    "ready for your next command",
+    "我已准备好",
+    "请给出你的第一个指令",
+)
+_BOOTSTRAP_RE = re.compile("|".join(re.escape(m) for m in _BOOTSTRAP_MARKERS))
+
+# stderr substrings that mean "capacity / rate limit": only these are retried.
+_RETRYABLE_MARKERS = (
+    "status 429",
+    "code\": 429",
+    "Too Many Requests",
+    "No capacity",
+    "Retrying with backoff",
+)
+
+# A few retries help with transient capacity (429) errors.
+_MAX_ATTEMPTS = 3
+_FIRST_BACKOFF_S = 5
+_MAX_BACKOFF_S = 60
+
+# npm's Windows shim runs `node "%dp0%\<entry>.js" %*` (older shims: `%~dp0`).
+_CMD_SHIM_JS_RE = re.compile(r'"%~?dp0%?\\([^"%]+?\.js)"', re.IGNORECASE)
+# cmd.exe re-parses a .cmd/.bat command line; these can't be quoted safely through it.
+_CMD_UNSAFE_CHARS = frozenset('&|<>^%!"\r\n')
+
+# (launcher argv prefix, launcher is a .cmd/.bat that cmd.exe will re-parse)
+_gemini_launcher: Optional[tuple[list[str], bool]] = None
 
 
-def _extract_first_json_object(text: str) -> dict:
-    text = text.strip()
-    if not text:
+def _node_entry_from_cmd_shim(shim: str) -> Optional[list[str]]:
+    """`[node, entry.js]` for an npm .cmd shim, so the CLI can be started without cmd.exe."""
+    try:
+        with open(shim, "r", encoding="utf-8", errors="replace") as f:
+            m = _CMD_SHIM_JS_RE.search(f.read())
+    except OSError:
+        return None
+    if m is None:
+        return None
+    shim_dir = os.path.dirname(shim)
+    entry = os.path.join(shim_dir, m.group(1))
+    node = os.path.join(shim_dir, "node.exe")
+    if not os.path.exists(node):
+        node = shutil.which("node")
+    if not node or not os.path.exists(entry):
+        return None
+    return [node, entry]
+
+
+def _resolve_gemini() -> tuple[list[str], bool]:
+    """
+    Locate the `gemini` launcher once per process (gemini.cmd / gemini.exe on Windows).
+    npm's gemini.cmd shim is bypassed by running its node entry script directly: cmd.exe would
+    otherwise re-interpret `&`, `%`, `^`, `|`, newlines... in our (list2cmdline-quoted) arguments.
+    Not cached while missing, so installing the CLI mid-session still works.
+    """
+    global _gemini_launcher
+    if _gemini_launcher is None:
+        exe = shutil.which("gemini")
+        if not exe:
+            raise GeminiCliError("Gemini CLI not found: `gemini` is not on PATH.")
+        if os.path.splitext(exe)[1].lower() in (".cmd", ".bat"):
+            node_argv = _node_entry_from_cmd_shim(exe)
+            _gemini_launcher = (node_argv, False) if node_argv else ([exe], True)
+        else:
+            _gemini_launcher = ([exe], False)
+    return _gemini_launcher
+
+
+def _extract_first_json_object(data: bytes) -> dict:
+    data = data.strip()
+    if not data:
         raise GeminiCliError("Gemini CLI returned empty stdout.")
 
-    # Usually stdout is a single JSON object. Be defensive in case extra logs leak to stdout.
+    # Usually stdout is a single JSON object (maybe after a log line): orjson parses the outermost
+    # `{...}` straight from the raw bytes, without decoding to str or copying the slice.
+    if orjson is not None:
+        start, end = data.find(b"{"), data.rfind(b"}")
+        if start != -1 and end > start:
+            try:
+                return orjson.loads(memoryview(data)[start : end + 1])
+            except orjson.JSONDecodeError:
+                pass
+
+    text = data.decode("utf-8", errors="replace")
+    # Be defensive in case extra logs leak to stdout: decode the top-level objects in turn and return
+    # the first that looks like the CLI reply (`response` / `session_id`), so a JSON log or telemetry
+    # line printed before it isn't taken for the reply. Failing with no such object, the last one wins.
+    # A start that fails past the next `{` is a broken object enclosing it: report that instead of
+    # returning something nested inside it.
     start = text.find("{")
-    end = text.rfind("}")
-    if start == -1 or end == -1 or end < start:
+    if start == -1:
         raise GeminiCliError(f"Gemini CLI stdout is not JSON. Head: {text[:200]}")
+    decoder = json.JSONDecoder()
+    last: Optional[dict] = None
+    while start != -1:
+        try:
+            value, end = decoder.raw_decode(text, start)
+        except json.JSONDecodeError as e:
+            nxt = text.find("{", start + 1)
+            if (nxt != -1 and e.pos > nxt) or (nxt == -1 and last is None):
+                raise GeminiCliError(f"Failed to parse Gemini CLI JSON stdout: {e}. Head: {text[:200]}") from e
+            start = nxt
+            continue
+        if "response" in value or "session_id" in value:
+            return value
+        last = value
+        start = text.find("{", end)
+    return last
+
+
+def _build_argv(
+    prompt: str, model: Optional[str], output_format: str, include_directories: Optional[list[str]]
+) -> list[str]:
+    launcher, via_cmd = _resolve_gemini()
+    args = ["-p", prompt, "-o", output_format]
+    if model:
+        args += ["-m", model]
+    # Normalize and dedupe include dirs (dict keeps first-seen order).
+    norm_dirs = dict.fromkeys(os.path.abspath(d) for d in include_directories or () if d)
+    for d in norm_dirs:
+        args += ["--include-directories", d]
+    if via_cmd:
+        # Shim without a recognizable node entry: refuse what cmd.exe would mangle instead of
+        # silently running a truncated / different command.
+        bad = next((a for a in args if not _CMD_UNSAFE_CHARS.isdisjoint(a)), None)
+        if bad is not None:
+            raise GeminiCliError(
+                f"Argument can't be passed safely through {launcher[0]} (cmd metacharacters): {bad[:80]!r}"
+            )
+    return launcher + args
+
+
+def _completed(args, returncode: int, out: Optional[bytes], err: Optional[bytes]) -> subprocess.CompletedProcess[bytes]:
+    # Output stays bytes until the end: the JSON reply is parsed from bytes, and only the attempt
+    # that is returned gets decoded.
+    return subprocess.CompletedProcess(args, returncode, out or b"", err or b"")
+
+
+def _decode(b: bytes) -> str:
+    return b.decode("utf-8", errors="replace")
+
+
+def _try_parse_reply(stdout: bytes, output_format: str) -> Optional[dict]:
+    if output_format != "json":
+        return None
     try:
-        return json.loads(text[start : end + 1])
-    except Exception as e:
-        raise GeminiCliError(f"Failed to parse Gemini CLI JSON stdout: {e}. Head: {text[:200]}") from e
+        return _extract_first_json_object(stdout)
+    except Exception:
+        # If parsing fails here, fall through and let the normal parser handle it later.
+        return None
+
+
+def _is_bootstrap_reply(raw: Optional[dict]) -> bool:
+    """
+    Some Gemini CLI setups return a "ready" bootstrap message on the first call
+    and ignore the actual prompt.
+    """
+    if raw is None:
+        return False
+    resp = str(raw.get("response", "") or "").strip().lower()
+    return _BOOTSTRAP_RE.search(resp) is not None
+
+
+def _check_retryable(completed: subprocess.CompletedProcess[bytes], attempt: int) -> None:
+    """Raise unless a failed attempt hit a capacity / rate-limit signal and attempts remain."""
+    stderr = _decode(completed.stderr)
+    retryable = any(s in stderr for s in _RETRYABLE_MARKERS)
+    if (not retryable) or attempt == _MAX_ATTEMPTS:
+        raise GeminiCliError(
+            "Gemini CLI failed "
+            f"(code={completed.returncode}). Stderr head: {stderr[:400]}"
+        )
+
+
+def _to_result(
+    completed: Optional[subprocess.CompletedProcess[bytes]], output_format: str, raw: Optional[dict] = None
+) -> GeminiCliResult:
+    if completed is None:
+        raise GeminiCliError("Gemini CLI did not start.")
+
+    stdout = _decode(completed.stdout)
+    stderr = _decode(completed.stderr)
+
+    if output_format == "json":
+        if raw is None:
+            raw = _extract_first_json_object(completed.stdout)
+        return GeminiCliResult(
+            session_id=raw.get("session_id"),
+            response=raw.get("response", ""),
+            raw=raw,
+            stdout=stdout,
+            stderr=stderr,
+            returncode=completed.returncode,
+        )
+
+    # text / stream-json: return raw stdout as response
+    return GeminiCliResult(
+        session_id=None,
+        response=stdout,
+        raw={},
+        stdout=stdout,
+        stderr=stderr,
+        returncode=completed.returncode,
+    )
 
 
 def run_gemini_cli(
@@ -57,146 +260,93 @@ def run_gemini_cli(
     Call Gemini CLI in headless mode (non-interactive) and return the parsed result.
 
     Notes:
-    - We write the prompt to a UTF-8 temp file to avoid Windows quoting/length issues.
+    - `gemini` is executed directly (no shell; npm's Windows .cmd shim is bypassed via node); the
+      stdin payload is piped to it as UTF-8 to avoid Windows argv quoting/length issues.
+    - `prompt` goes on the command line and must stay single-line; put multi-line content in
+      `stdin_text`.
     - stdout is expected to be a single JSON object when output_format="json".
     - stderr contains Gemini CLI logs; it is returned for debugging.
     """
-    if include_directories is None:
-        include_directories = []
-
-    # Normalize and dedupe include dirs.
-    norm_dirs: list[str] = []
-    seen = set()
-    for d in include_directories:
-        if not d:
-            continue
-        nd = os.path.abspath(d)
-        if nd not in seen:
-            seen.add(nd)
-            norm_dirs.append(nd)
+    argv = _build_argv(prompt, model, output_format, include_directories)
 
-    stdin_file = None
+    # Feed the (large/complex) payload through a stdin pipe: no argv quoting/length limits and
+    # no temp file. Encoded once here, reused by retries; bytes avoid newline translation.
+    run_kwargs: dict = {"stdin": subprocess.DEVNULL}
     if stdin_text is not None:
-        # Feed large/complex payload via stdin to avoid Windows argv quoting issues.
-        with tempfile.NamedTemporaryFile("w", delete=False, encoding="utf-8", suffix=".stdin.txt") as f:
-            stdin_file = f.name
-            f.write(stdin_text)
+        run_kwargs = {"input": stdin_text.encode("utf-8")}
 
-    try:
-        # A few retries help with transient capacity (429) errors.
-        max_attempts = 3
-        sleep_s = 5
-
-        last_completed: Optional[subprocess.CompletedProcess[str]] = None
-        for attempt in range(1, max_attempts + 1):
-            ps_lines = []
-            ps_lines.append("$ErrorActionPreference = 'Continue'")
-            ps_lines.append(
-                "$argsList = @('-p', %s, '-o', %s)"
-                % (_ps_quote(prompt), _ps_quote(output_format))
-            )
-            if model:
-                ps_lines.append("$argsList += @('-m', %s)" % _ps_quote(model))
-            if norm_dirs:
-                ps_lines.append("$inc = @(%s)" % (", ".join(_ps_quote(d) for d in norm_dirs)))
-                ps_lines.append("foreach ($d in $inc) { $argsList += @('--include-directories', $d) }")
-            if stdin_file:
-                ps_lines.append(f"Get-Content -Raw -Encoding UTF8 {_ps_quote(stdin_file)} | & gemini @argsList")
-            else:
-                ps_lines.append("& gemini @argsList")
-
-            last_completed = subprocess.run(
-                ["powershell.exe", "-NoProfile", "-Command", "\n".join(ps_lines)],
-                cwd=cwd,
-                capture_output=True,
-                text=True,
-                encoding="utf-8",
-                timeout=timeout_s,
-            )
+    sleep_s = _FIRST_BACKOFF_S
+    last_completed: Optional[subprocess.CompletedProcess[bytes]] = None
+    raw: Optional[dict] = None
+    for attempt in range(1, _MAX_ATTEMPTS + 1):
+        proc = subprocess.run(argv, cwd=cwd, capture_output=True, timeout=timeout_s, **run_kwargs)
+        last_completed = _completed(proc.args, proc.returncode, proc.stdout, proc.stderr)
 
-            stdout = last_completed.stdout or ""
-            stderr = last_completed.stderr or ""
-            if last_completed.returncode == 0:
-                # Some Gemini CLI setups return a "ready" bootstrap message on the first call
-                # and ignore the actual prompt. Detect and retry once.
-                if output_format == "json":
-                    try:
-                        raw = _extract_first_json_object(stdout)
-                        resp = str(raw.get("response", "") or "").strip().lower()
-                        bootstrap_markers = [
-                            "ready for your first command",
-                            "please provide your first command",
-                            "waiting for your command",
-                            "what can i do for you",
-                            "what would you like me to do",
-                            "i am ready for your first command",
-                            "i'm ready for your first command",
-                            "ready for your next command",
-                            "我已准备好",
-                            "请给出你的第一个指令",
-                        ]
-                        if any(m in resp for m in bootstrap_markers) and attempt < max_attempts:
-                            continue
-                    except Exception:
-                        # If parsing fails here, fall through and let the normal parser handle it later.
-                        pass
-                break
-
-            # Retry only on capacity / rate-limit signals.
-            retryable = any(
-                s in stderr
-                for s in [
-                    "status 429",
-                    "code\": 429",
-                    "Too Many Requests",
-                    "No capacity",
-                    "Retrying with backoff",
-                ]
-            )
-            if (not retryable) or attempt == max_attempts:
-                raise GeminiCliError(
-                    "Gemini CLI failed "
-                    f"(code={last_completed.returncode}). Stderr head: {stderr[:400]}"
-                )
+        if last_completed.returncode == 0:
+            # Parsed once here and reused for the result. Bootstrap reply instead of an answer: retry once.
+            raw = _try_parse_reply(last_completed.stdout, output_format)
+            if attempt < _MAX_ATTEMPTS and _is_bootstrap_reply(raw):
+                continue
+            break
 
-            # Backoff then retry.
-            try:
-                import time
+        _check_retryable(last_completed, attempt)
 
-                time.sleep(sleep_s)
-            except Exception:
-                pass
-            sleep_s = min(sleep_s * 3, 60)
-
-        if last_completed is None:
-            raise GeminiCliError("Gemini CLI did not start.")
-
-        stdout = last_completed.stdout or ""
-        stderr = last_completed.stderr or ""
-
-        if output_format == "json":
-            raw = _extract_first_json_object(stdout)
-            return GeminiCliResult(
-                session_id=raw.get("session_id"),
-                response=raw.get("response", ""),
-                raw=raw,
-                stdout=stdout,
-                stderr=stderr,
-                returncode=last_completed.returncode,
-            )
+        # Backoff then retry.
+        time.sleep(sleep_s)
+        sleep_s = min(sleep_s * 3, _MAX_BACKOFF_S)
 
-        # text / stream-json: return raw stdout as response
-        return GeminiCliResult(
-            session_id=None,
-            response=stdout,
-            raw={},
-            stdout=stdout,
-            stderr=stderr,
-            returncode=last_completed.returncode,
+    return _to_result(last_completed, output_format, raw)
+
+
+async def run_gemini_cli_async(
+    prompt: str,
+    *,
+    model: Optional[str] = None,
+    output_format: str = "json",
+    include_directories: Optional[list[str]] = None,
+    stdin_text: Optional[str] = None,
+    cwd: Optional[str] = None,
+    timeout_s: int = 600,
+) -> GeminiCliResult:
+    """
+    asyncio variant of run_gemini_cli() with the same arguments and retry policy.
+
+    The CLI runs via asyncio.create_subprocess_exec and rate-limit backoff is an `asyncio.sleep`,
+    so an event loop (e.g. the MCP server) can keep other requests going while one waits.
+    """
+    argv = _build_argv(prompt, model, output_format, include_directories)
+    payload = stdin_text.encode("utf-8") if stdin_text is not None else None
+
+    sleep_s = _FIRST_BACKOFF_S
+    last_completed: Optional[subprocess.CompletedProcess[bytes]] = None
+    raw: Optional[dict] = None
+    for attempt in range(1, _MAX_ATTEMPTS + 1):
+        proc = await asyncio.create_subprocess_exec(
+            *argv,
+            cwd=cwd,
+            stdin=subprocess.PIPE if payload is not None else subprocess.DEVNULL,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
         )
-    finally:
-        if stdin_file:
-            try:
-                os.remove(stdin_file)
-            except Exception:
-                pass
+        try:
+            out, err = await asyncio.wait_for(proc.communicate(payload), timeout=timeout_s)
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+            raise subprocess.TimeoutExpired(argv, timeout_s) from None
+        last_completed = _completed(argv, proc.returncode, out, err)
+
+        if last_completed.returncode == 0:
+            # Parsed once here and reused for the result. Bootstrap reply instead of an answer: retry once.
+            raw = _try_parse_reply(last_completed.stdout, output_format)
+            if attempt < _MAX_ATTEMPTS and _is_bootstrap_reply(raw):
+                continue
+            break
+
+        _check_retryable(last_completed, attempt)
+
+        # Backoff then retry, without blocking the event loop.
+        await asyncio.sleep(sleep_s)
+        sleep_s = min(sleep_s * 3, _MAX_BACKOFF_S)
+
+    return _to_result(last_completed, output_format, raw)
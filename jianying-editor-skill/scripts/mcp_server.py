@@ -1,6 +1,9 @@
 
 import asyncio
+import importlib
+import locale
 import os
+import subprocess
 import sys
 import json
 from mcp.server.fastmcp import FastMCP
@@ -23,9 +26,53 @@ except ImportError:
     print(f"[-] Error: Could not find jy_wrapper in {scripts_path}")
     sys.exit(1)
 
+# 工具脚本路径只解析/检查一次, 不在每次工具调用时重复 join + stat
+_SMART_SCRIPT = os.path.join(scripts_path, "smart_rough_cut.py")
+_SMART_SCRIPT_EXISTS = os.path.exists(_SMART_SCRIPT)
+_SEARCH_SCRIPT = os.path.join(scripts_path, "asset_search.py")
+
+
+def _rough_cut_in_process(video_path):
+    """
+    在进程内运行 分析 + 生成草稿 (省掉每次调用的解释器启动 + 导入), 返回 (ok, 输出)。
+    smart_rough_cut 的输出通过 log 回调按调用收集, 不经过 stdout (stdio 模式下它是 MCP 协议通道),
+    所以多个调用可以并行, 互不串台。
+    """
+    lines = []
+    log = lines.append
+    try:
+        # 成功后由 sys.modules 缓存; 失败不缓存, 装好依赖后下次调用即可用, 无需重启服务
+        import smart_rough_cut as rough_cut
+
+        clips = rough_cut.analyze_video_content(video_path, log=log)
+        log(f"[*] Found {len(clips)} highlights.")
+        log(rough_cut.clips_to_json(clips))
+        rough_cut.create_rough_cut_project(video_path, clips, log=log)
+    except Exception as e:
+        if isinstance(e, ImportError):
+            # 让新装上的依赖目录在下次调用时可见
+            importlib.invalidate_caches()
+        log(repr(e))
+        return False, "\n".join(lines)
+    return True, "\n".join(lines)
+
 # --- 2. 初始化 MCP Server ---
 mcp = FastMCP("JianYing-Automation")
 
+
+async def _run_script(*cmd):
+    """
+    异步运行子进程, 不阻塞事件循环 (多个 MCP 请求可以并行处理)。
+    返回 (returncode, stdout, stderr), 按本地编码解码 (与 text=True 一致)。
+    """
+    proc = await asyncio.create_subprocess_exec(
+        *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+    )
+    out, err = await proc.communicate()
+    enc = locale.getpreferredencoding(False)
+    return proc.returncode, out.decode(enc, errors="replace"), err.decode(enc, errors="replace")
+
+
 @mcp.tool()
 async def create_simple_video(project_name: str, video_path: str, subtitle: str = None) -> str:
     """
@@ -52,21 +99,18 @@ async def smart_rough_cut(video_path: str) -> str:
     对一个长视频进行智能分析并生成精彩时刻粗剪合集。
     会自动寻找具有画面冲击力的时刻（如动作变化、喂鸡等）并拼接。
     """
-    # 动态导入防止循环依赖
-    smart_script = os.path.join(scripts_path, "smart_rough_cut.py")
-    if not os.path.exists(smart_script):
+    if not _SMART_SCRIPT_EXISTS:
         return "Error: smart_rough_cut.py not found."
+    if not os.path.exists(video_path):
+        return f"Rough cut failed.\nError: File not found: {video_path}"
     
-    # 简单调用现有的逻辑
-    import subprocess
-    cmd = [sys.executable, smart_script, video_path]
-    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-    stdout, stderr = process.communicate()
+    # 在线程里跑现有逻辑, 不阻塞事件循环
+    ok, output = await asyncio.to_thread(_rough_cut_in_process, video_path)
     
-    if process.returncode == 0:
-        return f"Rough cut complete. Output:\n{stdout}"
+    if ok:
+        return f"Rough cut complete. Output:\n{output}"
     else:
-        return f"Rough cut failed.\nError: {stderr}"
+        return f"Rough cut failed.\nError: {output}"
 
 @mcp.tool()
 async def search_assets(query: str, category: str = "filters") -> str:
@@ -77,10 +121,10 @@ async def search_assets(query: str, category: str = "filters") -> str:
         query: 搜索关键词（如 '复古', '打字机'）
         category: 类别, 可选: filters, transitions, video_effects, text_effects, animations
     """
-    search_script = os.path.join(scripts_path, "asset_search.py")
-    import subprocess
-    cmd = [sys.executable, search_script, query, "-c", category]
-    result = subprocess.check_output(cmd, text=True)
+    cmd = [sys.executable, _SEARCH_SCRIPT, query, "-c", category]
+    returncode, result, stderr = await _run_script(*cmd)
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, cmd, output=result, stderr=stderr)
     return result
 
 if __name__ == "__main__":
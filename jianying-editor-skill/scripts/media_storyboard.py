@@ -1,15 +1,75 @@
 from __future__ import annotations
 
 import os
+import struct
 import subprocess
 
+import ffmpeg_pool
+
+# ISO-BMFF containers: the movie header box (moov/mvhd) carries the duration.
+_MP4_EXTS = frozenset({".mp4", ".m4v", ".mov", ".m4a", ".3gp"})
+
+
+def _parse_mvhd(body: bytes) -> float:
+    # version(1) flags(3), then creation/modification times, timescale, duration (64-bit in v1).
+    if body[0] == 1:
+        timescale, duration = struct.unpack_from(">IQ", body, 20)
+        unset = 0xFFFFFFFFFFFFFFFF
+    else:
+        timescale, duration = struct.unpack_from(">II", body, 12)
+        unset = 0xFFFFFFFF
+    if not timescale or duration == unset:
+        return 0.0
+    return duration / timescale
+
+
+def _mp4_header_duration_seconds(media_path: str) -> float:
+    """
+    Read the duration from an MP4/MOV `moov/mvhd` box by walking box headers (seeks only, the media
+    data is never read). Returns 0.0 if the box is missing, unset (e.g. fragmented MP4) or unreadable.
+    """
+    try:
+        with open(media_path, "rb") as f:
+            pos, end = 0, os.fstat(f.fileno()).st_size
+            want = b"moov"
+            for _ in range(64):
+                if pos + 8 > end:
+                    break
+                f.seek(pos)
+                box_size, box_type = struct.unpack(">I4s", f.read(8))
+                header_len = 8
+                if box_size == 1:
+                    box_size = struct.unpack(">Q", f.read(8))[0]
+                    header_len = 16
+                elif box_size == 0:
+                    box_size = end - pos
+                if box_size < header_len:
+                    break
+                if box_type == want:
+                    if want == b"mvhd":
+                        return _parse_mvhd(f.read(min(box_size - header_len, 32)))
+                    # Descend into moov.
+                    want, end, pos = b"mvhd", pos + box_size, pos + header_len
+                    continue
+                pos += box_size
+    except (OSError, struct.error, IndexError):
+        pass
+    return 0.0
+
 
 def ffprobe_duration_seconds(media_path: str) -> float:
     """
-    Return media duration in seconds using ffprobe. Returns 0.0 on failure.
+    Return media duration in seconds. MP4/MOV files are read from the container header; other
+    formats, or headers without a usable duration, go through ffprobe. Returns 0.0 on failure.
     """
+    if not os.path.isabs(media_path):
+        media_path = os.path.abspath(media_path)
+    if os.path.splitext(media_path)[1].lower() in _MP4_EXTS:
+        dur = _mp4_header_duration_seconds(media_path)
+        if dur > 0:
+            return dur
     try:
-        r = subprocess.run(
+        r = ffmpeg_pool.run(
             [
                 "ffprobe",
                 "-v",
@@ -18,7 +78,7 @@ def ffprobe_duration_seconds(media_path: str) -> float:
                 "format=duration",
                 "-of",
                 "default=nokey=1:noprint_wrappers=1",
-                os.path.abspath(media_path),
+                media_path,
             ],
             capture_output=True,
             text=True,
@@ -44,17 +104,60 @@ def make_storyboard_image(
     Create a contact-sheet storyboard image (default 4x4) for a video using ffmpeg.
     Returns out_image_path.
     """
-    video_path = os.path.abspath(video_path)
-    out_image_path = os.path.abspath(out_image_path)
+    # Callers (material analysis) already pass absolute paths; only normalize relative ones.
+    if not os.path.isabs(video_path):
+        video_path = os.path.abspath(video_path)
+    if not os.path.isabs(out_image_path):
+        out_image_path = os.path.abspath(out_image_path)
     os.makedirs(os.path.dirname(out_image_path), exist_ok=True)
 
     frames = tiles_x * tiles_y
-    dur = ffprobe_duration_seconds(video_path) or 60.0
+    dur = ffprobe_duration_seconds(video_path)
+    if dur <= 0:
+        # Unknown duration: sample with the fps filter (decodes the whole stream).
+        return _storyboard_by_fps(video_path, out_image_path, tiles_x, tiles_y, scale_width, 60.0)
+
+    # One input per tile, each opened with an input-side -ss: ffmpeg seeks to the nearest keyframe
+    # and decodes only up to the sample point, instead of decoding the whole video through `fps`.
+    # Samples sit at the middle of N equal slices so the last one stays inside the stream.
+    cmd = ["ffmpeg", "-y", "-hide_banner", "-loglevel", "error"]
+    for i in range(frames):
+        cmd += ["-ss", f"{(i + 0.5) * dur / frames:.3f}", "-i", video_path]
+    graph = ";".join(
+        f"[{i}:v]trim=end_frame=1,setpts=PTS-STARTPTS,scale={scale_width}:-1,setsar=1[v{i}]" for i in range(frames)
+    )
+    graph += ";" + "".join(f"[v{i}]" for i in range(frames))
+    graph += f"concat=n={frames}:v=1:a=0,tile={tiles_x}x{tiles_y}[out]"
+    cmd += ["-filter_complex", graph, "-map", "[out]", "-frames:v", "1", out_image_path]
+    # Don't mistake a stale image for this run's output.
+    if os.path.exists(out_image_path):
+        os.remove(out_image_path)
+    try:
+        ffmpeg_pool.run(cmd, check=True, timeout=300)
+    except subprocess.CalledProcessError:
+        pass
+    if os.path.exists(out_image_path) and os.path.getsize(out_image_path) > 0:
+        return out_image_path
+
+    # The seek points come from the container duration. When the video stream ends earlier (longer
+    # audio, trailing data) the late inputs yield no frame and nothing is written: decode instead.
+    return _storyboard_by_fps(video_path, out_image_path, tiles_x, tiles_y, scale_width, dur)
+
+
+def _storyboard_by_fps(
+    video_path: str,
+    out_image_path: str,
+    tiles_x: int,
+    tiles_y: int,
+    scale_width: int,
+    dur: float,
+) -> str:
+    frames = tiles_x * tiles_y
     # Sample N frames across the whole duration: total frames ~= duration * (N/duration) = N.
     fps_expr = f"{frames}/{dur:.6f}"
 
     vf = f"fps={fps_expr},scale={scale_width}:-1,tile={tiles_x}x{tiles_y}"
-    subprocess.run(
+    ffmpeg_pool.run(
         [
             "ffmpeg",
             "-y",
@@ -73,4 +176,3 @@ def make_storyboard_image(
         timeout=300,
     )
     return out_image_path
-
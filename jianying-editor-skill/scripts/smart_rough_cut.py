@@ -2,9 +2,16 @@
 import sys
 import os
 import json
-import re
 from pathlib import Path
 
+try:
+    import orjson  # 可选: 更快地解析 SSE 流 (Optional: faster parsing of the SSE stream)
+except ImportError:
+    orjson = None
+
+_json_loads = orjson.loads if orjson is not None else json.loads
+_json_decoder = json.JSONDecoder()
+
 # --- 1. 环境配置 (路径注入) ---
 current_dir = os.path.dirname(os.path.abspath(__file__))
 # 注入 JianYing Wrapper 路径 (当前目录)
@@ -22,17 +29,42 @@ if not os.path.exists(api_skill_libs):
 
 sys.path.append(api_skill_libs)
 
-try:
-    from jy_wrapper import JyProject
-    from api_client import AntigravityClient
-except ImportError as e:
-    print(f"[-] Environment Error: {e}")
-    print(f"search path: {sys.path}")
-    sys.exit(1)
+# jy_wrapper / api_client 在用到时才导入: 本模块也会被进程内调用方 (mcp_server) 导入,
+# 缺依赖时调用方拿到 ImportError, 而不是在导入阶段 print + sys.exit. 命令行入口仍会先检查环境.
 
 # --- 2. 视频分析逻辑 ---
-def analyze_video_content(video_path):
-    print(f"[*] Analyzing video content using Gemini-3-Pro...")
+def clips_to_json(clips):
+    """片段列表 -> 缩进 2 的 JSON 文本 (保留中文)."""
+    if orjson is not None:
+        return orjson.dumps(clips, option=orjson.OPT_INDENT_2).decode("utf-8")
+    return json.dumps(clips, indent=2, ensure_ascii=False)
+
+def _decode_first_json_array(text):
+    """
+    从最外层的 `[` 解码 JSON 数组, 解析器在匹配的 `]` 处停止; 解不出来返回 None.
+    数组之前说明文字里的方括号 (e.g. "[注]") 会被跳过; 但外层数组还不完整 (流式读取中) 或有语法错误时
+    返回 None, 不会退到它内部的 `[` 去返回一个内层数组.
+    """
+    start = text.find("[")
+    while start != -1:
+        try:
+            return _json_decoder.raw_decode(text, start)[0]
+        except json.JSONDecodeError as e:
+            # 读到了文本末尾 (或字符串还没闭合): 还在流式接收中
+            if e.pos >= len(text) or e.msg.startswith("Unterminated string"):
+                return None
+            nxt = text.find("[", start + 1)
+            # 出错位置越过了下一个 `[`: 它嵌在这个坏掉的外层值里面
+            if nxt != -1 and e.pos > nxt:
+                return None
+            start = nxt
+    return None
+
+def analyze_video_content(video_path, log=print):
+    """log: 接收一行文本的回调 (默认 print; 进程内调用方可以传自己的收集函数, 不经过 stdout)"""
+    from api_client import AntigravityClient
+
+    log(f"[*] Analyzing video content using Gemini-3-Pro...")
     
     client = AntigravityClient()
     model = "gemini-3-pro"
@@ -60,48 +92,65 @@ def analyze_video_content(video_path):
         )
         
         if not response or response.status_code != 200:
-            print(f"[-] API Error: {response}")
+            log(f"[-] API Error: {response}")
             return []
             
         # Parse Streaming Response
-        full_content = ""
+        parts = []
+        clips = None
         for line in response.iter_lines():
             if not line: continue
-            line_str = line.decode('utf-8')
-            if line_str.startswith("data: "):
-                data_str = line_str[6:]
-                if data_str.strip() == "[DONE]": break
+            # 直接在 bytes 上处理, 交给 JSON 解析器一次性完成 UTF-8 解码
+            if line.startswith(b"data: "):
+                data_str = line[6:].strip()
+                if data_str == b"[DONE]": break
+                # 非 JSON 的片段直接跳过, 不走异常路径
+                if not data_str.startswith(b"{"): continue
                 try:
-                    data = json.loads(data_str)
+                    data = _json_loads(data_str)
                     content = data.get("choices", [{}])[0].get("delta", {}).get("content", "")
-                    if content: full_content += content
-                except: pass
+                except (ValueError, LookupError, AttributeError, TypeError):
+                    # 坏 JSON / 缺字段 / 字段类型不对 (e.g. "delta": null)
+                    continue
+                if content: parts.append(content)
+                # 数组一闭合就停止读取剩余的流 (Stop once the JSON array is complete)
+                if content and "]" in content:
+                    clips = _decode_first_json_array("".join(parts))
+                    if clips is not None:
+                        response.close()
+                        break
         
-        # Extract JSON
-        clean_json = full_content.strip()
-        # Remove Markdown wrappers
-        match = re.search(r'\[.*\]', clean_json, re.DOTALL)
-        if match:
-            clean_json = match.group(0)
-            
+        if clips is not None:
+            return clips
+
+        # Extract JSON (skips Markdown wrappers / prose around the array)
+        clean_json = "".join(parts).strip()
+        clips = _decode_first_json_array(clean_json)
+        if clips is not None:
+            return clips
         return json.loads(clean_json)
 
     except Exception as e:
-        print(f"[-] Analysis Failed: {e}")
+        log(f"[-] Analysis Failed: {e}")
         return []
 
 # --- 3. 剪映工程生成逻辑 ---
-def create_rough_cut_project(video_path, clips):
+def create_rough_cut_project(video_path, clips, log=print):
+    # 模型偶尔给出非对象元素: 跳过, 不在 clip.get 上崩溃
+    clips = [c for c in clips if isinstance(c, dict)] if isinstance(clips, list) else []
     if not clips:
-        print("[-] No clips found to edit.")
+        log("[-] No clips found to edit.")
         return
 
     project_name = f"RoughCut_{os.path.basename(video_path).split('.')[0]}_{len(clips)}clips"
-    print(f"[*] Creating JianYing Draft: {project_name}")
+    log(f"[*] Creating JianYing Draft: {project_name}")
     
+    from jy_wrapper import JyProject
     jy = JyProject(project_name, overwrite=True)
     
     total_dur = 0
+    # 视频轨当前末尾 (微秒): 本地累计, 不再每个片段都重新扫描整条轨道 (O(N^2) -> O(N))
+    current_end_us = jy.get_track_duration("MainVideo")
     
     # Track 1: Main Video (Cut)
     # Track 2: Text Description (Subtitle/Marker)
@@ -116,16 +165,21 @@ def create_rough_cut_project(video_path, clips):
         # source_start needs to be parsed from HH:MM:SS or just passed as is if jy_wrapper supports str
         # pyJianYingDraft supports string "HH:MM:SS" for start times usually, but let's ensure.
         
-        print(f"  > Adding Clip {i+1}: {desc} ({start_time_str}, {dur_sec}s)")
+        log(f"  > Adding Clip {i+1}: {desc} ({start_time_str}, {dur_sec}s)")
         
         # Add Clip to Video Track
         try:
-            jy.add_clip(
+            clip_start_us = current_end_us
+            seg = jy.add_clip(
                 media_path=video_path,
                 source_start=start_time_str,
                 duration=f"{dur_sec}s",
+                target_start=clip_start_us,
                 track_name="MainVideo"
             )
+            if seg:
+                # 用实际落盘的时长推进 (片段可能因素材不足被截短)
+                current_end_us = seg.target_timerange.start + seg.target_timerange.duration
             
             # Add Text Marker (on top)
             # Calculated start time for text is the current total duration
@@ -135,13 +189,10 @@ def create_rough_cut_project(video_path, clips):
             # actually add_text_simple(start_time=None) gets track duration of TextTrack.
             # We want to align with VideoTrack. 
             
-            # Get current end of video track
-            current_end = jy.get_track_duration("MainVideo") - (dur_sec * 1000000)
-            
             # Add text at the start of this clip
             jy.add_text_simple(
                 text=desc,
-                start_time=current_end, # Align with video clip start
+                start_time=clip_start_us, # Align with video clip start
                 duration=f"{dur_sec}s",
                 track_name="Subtitles",
                 font_size=6,
@@ -150,12 +201,20 @@ def create_rough_cut_project(video_path, clips):
             )
             
         except Exception as e:
-            print(f"  [!] Failed to add clip: {e}")
+            log(f"  [!] Failed to add clip: {e}")
 
     jy.save()
-    print(f"[+] Project Saved: {project_name}")
+    log(f"[+] Project Saved: {project_name}")
 
 if __name__ == "__main__":
+    try:
+        import jy_wrapper  # noqa: F401
+        import api_client  # noqa: F401
+    except ImportError as e:
+        print(f"[-] Environment Error: {e}")
+        print(f"search path: {sys.path}")
+        sys.exit(1)
+
     if len(sys.argv) < 2:
         print("Usage: python smart_rough_cut.py <video_path>")
         sys.exit(1)
@@ -169,7 +228,7 @@ if __name__ == "__main__":
     # Phase 1
     clips = analyze_video_content(video_file)
     print(f"[*] Found {len(clips)} highlights.")
-    print(json.dumps(clips, indent=2, ensure_ascii=False))
+    print(clips_to_json(clips))
     
     # Phase 2
     create_rough_cut_project(video_file, clips)
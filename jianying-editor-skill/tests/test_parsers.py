@@ -0,0 +1,188 @@
+import os
+import random
+import sys
+import unittest
+from unittest import mock
+
+# Bootstrap path
+current_dir = os.path.dirname(os.path.abspath(__file__))
+skill_root = os.path.dirname(current_dir)
+scripts_path = os.path.join(skill_root, "scripts")
+if scripts_path not in sys.path:
+    sys.path.insert(0, scripts_path)
+
+import auto_edit_gemini_cli
+import gemini_cli_bridge
+import smart_rough_cut
+from gemini_cli_bridge import GeminiCliError
+
+
+class TestDecodeFirstJsonArray(unittest.TestCase):
+    """smart_rough_cut._decode_first_json_array: 流式读取中的部分 / 嵌套 / 代码块 / 坏 JSON"""
+
+    def test_table(self):
+        cases = [
+            ('[{"start":"00:00:01","duration":3}]', [{"start": "00:00:01", "duration": 3}]),
+            ('```json\n[{"a":1}]\n```', [{"a": 1}]),
+            ('好的, 结果如下:\n[{"a":1}]\n以上。', [{"a": 1}]),
+            ('[注] 如下: [{"a":[1]}]', [{"a": [1]}]),
+            ('[{"a":1}] 之后的说明 [2]', [{"a": 1}]),
+            # 部分: 内层数组已闭合, 外层还没有 -> 继续读流
+            ('[{"start":"00:00:01","duration":3,"tags":["a"]', None),
+            ('[{"desc":"abc [1,2] more', None),
+            ('[{"a":1},', None),
+            ('[', None),
+            # 坏 JSON: 不退到内层数组
+            ('[{"start":"00:00:01","duration":[3]}, oops', None),
+            ('[{"a":1},]', None),
+            ("没有数组", None),
+            ("", None),
+        ]
+        for text, expected in cases:
+            with self.subTest(text=text):
+                self.assertEqual(smart_rough_cut._decode_first_json_array(text), expected)
+
+
+class TestExtractFirstJsonObject(unittest.TestCase):
+    """gemini_cli_bridge._extract_first_json_object, 有 / 没有 orjson 两条路径结果一致"""
+
+    ok_cases = [
+        (b'{"session_id":"s","response":"ok"}', {"session_id": "s", "response": "ok"}),
+        (b'  \n{"response":"x","stats":{"a":1}}\n', {"response": "x", "stats": {"a": 1}}),
+        (b'log line\n{"response":"ok"}', {"response": "ok"}),
+        (b'log {bad}\n{"response":"ok"} trailing }', {"response": "ok"}),
+        # JSON 日志行在回复之前: 取带回复字段的那个
+        (b'{"level":"info","msg":"x {y}"}\n{"session_id":"s","response":"ok"}', {"session_id": "s", "response": "ok"}),
+        # 都不带回复字段: 取最后一个完整的顶层对象, 而不是内层
+        (b'{"a":{"b":1}} {"c":2}', {"c": 2}),
+        ('{"response":"中文"}'.encode("utf-8"), {"response": "中文"}),
+    ]
+    error_cases = [
+        b"",
+        b"   ",
+        b"not json",
+        b"{oops",
+        b"nothing {",
+        # 回复被截断: 报错, 不返回它内部的对象
+        b'{"level":"info"}\n{"session_id":"s","response":"ok","stats":{"a":1}',
+        b'{"response":"x","stats":{"a":1},}',
+    ]
+
+    def _check(self):
+        for data, expected in self.ok_cases:
+            with self.subTest(data=data):
+                self.assertEqual(gemini_cli_bridge._extract_first_json_object(data), expected)
+        for data in self.error_cases:
+            with self.subTest(data=data):
+                with self.assertRaises(GeminiCliError):
+                    gemini_cli_bridge._extract_first_json_object(data)
+
+    def test_default(self):
+        self._check()
+
+    def test_without_orjson(self):
+        with mock.patch.object(gemini_cli_bridge, "orjson", None):
+            self._check()
+
+
+class TestExtractJsonFromText(unittest.TestCase):
+    """auto_edit_gemini_cli._extract_json_from_text"""
+
+    def test_table(self):
+        cases = [
+            ('{"tags":["a","b"],"desc":"x"}', {"tags": ["a", "b"], "desc": "x"}),
+            ('```json\n{"tags":["a"],"desc":"y"}\n```', {"tags": ["a"], "desc": "y"}),
+            ('说明\n```\n[1, 2]\n```\n结束', [1, 2]),
+            ('[note] {"tags":["a"],"desc":"x"}', {"tags": ["a"], "desc": "x"}),
+            ('结果: [{"srt_idx":1,"id":0}] 完', [{"srt_idx": 1, "id": 0}]),
+            ('{"a": [1]} 结束 }', {"a": [1]}),
+        ]
+        for text, expected in cases:
+            with self.subTest(text=text):
+                self.assertEqual(auto_edit_gemini_cli._extract_json_from_text(text), expected)
+
+    def test_malformed_outer_value_raises(self):
+        for text in [
+            "",
+            "no json here",
+            '[{"srt_idx":1,"id":2},{"srt_idx":2,"tra',
+            '{"tags":["a"],"desc":"x",}',
+            '[{bad}] {"a":1}',
+        ]:
+            with self.subTest(text=text):
+                with self.assertRaises(ValueError):
+                    auto_edit_gemini_cli._extract_json_from_text(text)
+
+
+def _reference_parse_srt(content):
+    """原先逐行扫描的 SRT 解析器, 作为正则版本的对照"""
+    content = content.replace("\r\n", "\n").replace("\r", "\n")
+    lines = [l.strip() for l in content.split("\n")]
+
+    def _parse_time(t):
+        t = t.replace(",", ".")
+        parts = t.split(":")
+        if len(parts) != 3:
+            return 0.0
+        h, m, s = parts
+        return float(h) * 3600.0 + float(m) * 60.0 + float(s)
+
+    items = []
+    i = 0
+    while i < len(lines):
+        if lines[i].isdigit() and i + 1 < len(lines) and "-->" in lines[i + 1]:
+            idx = int(lines[i])
+            time_line = lines[i + 1]
+            txt_lines = []
+            j = i + 2
+            while j < len(lines) and lines[j] and not lines[j].isdigit():
+                txt_lines.append(lines[j])
+                j += 1
+            start_str, end_str = [p.strip() for p in time_line.split("-->")[:2]]
+            text = " ".join([t for t in txt_lines if t]).strip()
+            items.append((idx, _parse_time(start_str), _parse_time(end_str), text))
+            i = j
+            continue
+        i += 1
+    return items
+
+
+class TestParseSrtContent(unittest.TestCase):
+    """parse_srt_content 与原逐行解析器在随机输入上逐项一致 (包括抛出的异常类型)"""
+
+    TOKENS = [
+        "1", "23", " 4 ", "7\t", "00:00:01,500 --> 00:00:02,000", "00:00:01.5-->1:2:3", "a-->b", "-->",
+        "x --> 00:01:02,03 --> 9", "00:00:61,9999 --> 10:00:00", "1:2", "hello", " wo rld ", "", "  ", "\t",
+    ]
+
+    @staticmethod
+    def _run(fn, content):
+        try:
+            return fn(content)
+        except Exception as e:
+            return type(e)
+
+    def test_matches_reference(self):
+        rng = random.Random(1)
+        for _ in range(20000):
+            content = rng.choice(["\n", "\r\n", "\r"]).join(
+                rng.choice(self.TOKENS) for _ in range(rng.randint(0, 12))
+            )
+            if rng.random() < 0.3:
+                content += "\n"
+            got = self._run(auto_edit_gemini_cli.parse_srt_content, content)
+            if isinstance(got, list):
+                got = [(it.idx, it.start, it.end, it.text) for it in got]
+            self.assertEqual(got, self._run(_reference_parse_srt, content), msg=repr(content))
+
+    def test_basic_file(self):
+        content = "1\r\n00:00:01,000 --> 00:00:02,500\r\nhello\r\nworld\r\n\r\n2\r\n00:00:03,000 --> 00:00:04,000\r\n再见\r\n"
+        items = auto_edit_gemini_cli.parse_srt_content(content)
+        self.assertEqual(
+            [(it.idx, it.start, it.end, it.text) for it in items],
+            [(1, 1.0, 2.5, "hello world"), (2, 3.0, 4.0, "再见")],
+        )
+
+
+if __name__ == "__main__":
+    unittest.main()